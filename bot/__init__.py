@@ -1,7 +1,7 @@
 from os import path as ospath, mkdir, system, getenv
 from logging import INFO, ERROR, FileHandler, StreamHandler, basicConfig, getLogger
 from traceback import format_exc
-from asyncio import Queue, Lock
+from asyncio import Semaphore
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from pyrogram import Client
@@ -27,10 +27,6 @@ ani_cache = {
 }
 ffpids_cache = list()
 
-ffLock = Lock()
-ffQueue = Queue()
-ff_queued = dict()
-
 class Var:
     API_ID, API_HASH, BOT_TOKEN = getenv("API_ID"), getenv("API_HASH"), getenv("BOT_TOKEN")
     MONGO_URI = getenv("MONGO_URI")
@@ -40,6 +36,10 @@ class Var:
         exit(1)
 
     RSS_ITEMS = getenv("RSS_ITEMS", "https://subsplease.org/rss/?r=1080").split()
+    POLL_FAST = int(getenv("POLL_FAST", "5"))
+    POLL_IDLE = int(getenv("POLL_IDLE", "300"))
+    POLL_BEFORE = int(getenv("POLL_BEFORE", "120"))
+    POLL_AFTER = int(getenv("POLL_AFTER", "1800"))
     FSUB_CHATS = list(map(int, getenv('FSUB_CHATS').split()))
     BACKUP_CHANNEL = getenv("BACKUP_CHANNEL") or ""
     MAIN_CHANNEL = int(getenv("MAIN_CHANNEL"))
@@ -47,6 +47,13 @@ class Var:
     FILE_STORE = int(getenv("FILE_STORE"))
     ADMINS = list(map(int, getenv("ADMINS", "1242011540").split()))
 
+    ANILIST_RPM = int(getenv("ANILIST_RPM", "90"))
+    HEDGE_DELAY = float(getenv("HEDGE_DELAY", "3"))
+    META_DEADLINE = float(getenv("META_DEADLINE", "30"))
+    META_TTL = int(getenv("META_TTL", "86400"))
+    META_NEG_TTL = int(getenv("META_NEG_TTL", "3600"))
+    META_LRU = int(getenv("META_LRU", "256"))
+
     SEND_SCHEDULE = getenv("SEND_SCHEDULE", "False").lower() == "true"
     BRAND_UNAME = getenv("BRAND_UNAME", "@username")
     FFCODE_1080 = getenv("FFCODE_1080") or """ffmpeg -i '{}' -progress '{}' -preset veryfast -c:v libx264 -s 1920x1080 -pix_fmt yuv420p -crf 30 -c:a libopus -b:a 32k -c:s copy -map 0 -ac 2 -ab 32k -vbr 2 -level 3.1 '{}' -y"""
@@ -54,15 +61,59 @@ class Var:
     FFCODE_480 = getenv("FFCODE_480") or """ffmpeg -i '{}' -progress '{}' -preset superfast -c:v libx264 -s 854x480 -pix_fmt yuv420p -crf 30 -c:a libopus -b:a 32k -c:s copy -map 0 -ac 2 -ab 32k -vbr 2 -level 3.1 '{}' -y"""
     FFCODE_360 = getenv("FFCODE_360") or """ffmpeg -i '{}' -progress '{}' -preset superfast -c:v libx264 -s 640x360 -pix_fmt yuv420p -crf 30 -c:a libopus -b:a 32k -c:s copy -map 0 -ac 2 -ab 32k -vbr 2 -level 3.1 '{}' -y"""
     QUALS = getenv("QUALS", "360 480 720 1080").split()
+    ENCODE_SLOTS = max(1, int(getenv("ENCODE_SLOTS", "1")))
+    UPLOAD_SLOTS = max(1, int(getenv("UPLOAD_SLOTS", "2")))
+    UPLOAD_BACKLOG = max(1, int(getenv("UPLOAD_BACKLOG", "4")))
+    SEGMENT_ENCODE = int(getenv("SEGMENT_ENCODE", "0"))
+    JOB_QUEUE = getenv("JOB_QUEUE", "")
+    JOB_LEASE = int(getenv("JOB_LEASE", "120"))
+    JOB_RETRIES = int(getenv("JOB_RETRIES", "3"))
+    JOB_OUT_DIR = getenv("JOB_OUT_DIR", "encode")
+    ENCODE_CACHE_DIR = getenv("ENCODE_CACHE_DIR", "cache")
+    ENCODE_CACHE_GB = float(getenv("ENCODE_CACHE_GB", "5"))
+    BENCH_PRESETS = getenv("BENCH_PRESETS", "ultrafast superfast veryfast faster fast").split()
+    BENCH_SLACK = float(getenv("BENCH_SLACK", "1.1"))
+    PRIO_POPULARITY = float(getenv("PRIO_POPULARITY", "1"))
+    PRIO_FRESH = float(getenv("PRIO_FRESH", "2"))
+    PRIO_COST = float(getenv("PRIO_COST", "1"))
+    COPY_QUALS = getenv("COPY_QUALS", "1080").split()
+    COPY_CODECS = getenv("COPY_CODECS", "h264").split()
+    COPY_MAX_KBPS = int(getenv("COPY_MAX_KBPS", "8000"))
+    TOR_SLOTS = max(1, int(getenv("TOR_SLOTS", "3")))
+    TOR_LISTEN = getenv("TOR_LISTEN", "0.0.0.0:6881,[::]:6881")
+    TOR_DL_KBPS = int(getenv("TOR_DL_KBPS", "0"))
+    TOR_UL_KBPS = int(getenv("TOR_UL_KBPS", "0"))
+    TOR_TORRENT_DL_KBPS = int(getenv("TOR_TORRENT_DL_KBPS", "0"))
+    TOR_TORRENT_UL_KBPS = int(getenv("TOR_TORRENT_UL_KBPS", "0"))
+    STALL_KBPS = int(getenv("STALL_KBPS", "10"))
+    STALL_WINDOW = int(getenv("STALL_WINDOW", "600"))
+    STALL_REQUEUE = int(getenv("STALL_REQUEUE", "1800"))
+    TOR_TRACKERS = (getenv("TOR_TRACKERS") or "udp://tracker.opentrackr.org:1337/announce udp://open.stealth.si:80/announce udp://exodus.desync.com:6969/announce udp://tracker.torrent.eu.org:451/announce").split()
+    STREAM_INGEST = getenv("STREAM_INGEST", "False").lower() == "true"
+    STREAM_HEAD_MB = int(getenv("STREAM_HEAD_MB", "8"))
+    DISK_FREE_GB = float(getenv("DISK_FREE_GB", "2"))
+    DISK_EST_SOURCE_MB = int(getenv("DISK_EST_SOURCE_MB", "1500"))
+    SCRATCH_TTL = int(getenv("SCRATCH_TTL", "21600"))
+    MULTI_ENCODE = getenv("MULTI_ENCODE", "False").lower() == "true"
+    FF_VOPTS = getenv("FF_VOPTS") or "-c:v libx264 -preset superfast -pix_fmt yuv420p -crf 30"
+    FF_AOPTS = getenv("FF_AOPTS") or "-c:a libopus -b:a 32k -ac 2 -vbr 2"
 
+    ADDONS = getenv("ADDONS", "False").lower() == "true"
+    ADDONS_CHAT = int(getenv("ADDONS_CHAT") or FILE_STORE)
+    SS_COUNT = int(getenv("SS_COUNT", "10"))
+    SAMPLE_SECS = int(getenv("SAMPLE_SECS", "30"))
     AS_DOC = getenv("AS_DOC", "True").lower() == "true"
     THUMB = getenv("THUMB", "https://te.legra.ph/file/621c8d40f9788a1db7753.jpg")
+    MEDIA_TTL = int(getenv("MEDIA_TTL", str(30 * 86400)))
     AUTO_DEL = getenv("AUTO_DEL", "True").lower() == "true"
     DEL_TIMER = int(getenv("DEL_TIMER", "600"))
     START_PHOTO = getenv("START_PHOTO", "https://te.legra.ph/file/120de4dbad87fb20ab862.jpg")
     START_MSG = getenv("START_MSG", "<b>Hey {first_name}</b>,\n\n    <i>I am Auto Animes Store & Automater Encoder Build with ❤️ !!</i>")
     START_BUTTONS = getenv("START_BUTTONS", "UPDATES|https://telegram.me/Matiz_Tech SUPPORT|https://t.me/+p78fp4UzfNwzYzQ5")
 
+upSlots = Semaphore(Var.UPLOAD_SLOTS)
+upBacklog = Semaphore(Var.UPLOAD_BACKLOG)
+
 if Var.THUMB and not ospath.exists("thumb.jpg"):
     system(f"wget -q {Var.THUMB} -O thumb.jpg")
     LOGS.info("Thumbnail has been Saved!!")
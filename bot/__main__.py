@@ -1,4 +1,4 @@
-from asyncio import create_task, create_subprocess_exec, create_subprocess_shell, run as asyrun, all_tasks, gather, sleep as asleep
+from asyncio import create_task, create_subprocess_exec, create_subprocess_shell, run as asyrun, all_tasks, gather
 from aiofiles import open as aiopen
 from pyrogram import idle
 from pyrogram.filters import command, user
@@ -6,9 +6,12 @@ from os import path as ospath, execl, kill
 from sys import executable
 from signal import SIGKILL
 
-from bot import bot, Var, bot_loop, sch, LOGS, ffQueue, ffLock, ffpids_cache, ff_queued
-from bot.core.auto_animes import fetch_animes
+from bot import bot, Var, bot_loop, sch, LOGS, ffpids_cache
+from bot.core.auto_animes import fetch_animes, resume_animes
+from bot.core.journal import journal
+from bot.core.tordownload import tor_session
 from bot.core.func_utils import clean_up, new_task, editMessage
+from bot.core.http_client import http
 from bot.modules.up_posts import upcoming_animes
 
 @bot.on_message(command('restart') & user(Var.ADMINS))
@@ -17,7 +20,6 @@ async def restart(client, message):
     rmessage = await message.reply('<i>Restarting...</i>')
     if sch.running:
         sch.shutdown(wait=False)
-    await clean_up()
     if len(ffpids_cache) != 0: 
         for pid in ffpids_cache:
             try:
@@ -26,6 +28,8 @@ async def restart(client, message):
             except (OSError, ProcessLookupError):
                 LOGS.error("Killing Process Failed !!")
                 continue
+    tor_session.save()
+    await clean_up(await journal.keep_paths())
     await (await create_subprocess_exec('python3', 'update.py')).wait()
     async with aiopen(".restartmsg", "w") as f:
         await f.write(f"{rmessage.chat.id}\n{rmessage.id}\n")
@@ -40,32 +44,22 @@ async def restart():
         except Exception as e:
             LOGS.error(e)
             
-async def queue_loop():
-    LOGS.info("Queue Loop Started !!")
-    while True:
-        if not ffQueue.empty():
-            post_id = await ffQueue.get()
-            await asleep(1.5)
-            ff_queued[post_id].set()
-            await asleep(1.5)
-            async with ffLock:
-                ffQueue.task_done()
-        await asleep(10)
-
 async def main():
     sch.add_job(upcoming_animes, "cron", hour=0, minute=30)
     await bot.start()
     await restart()
     LOGS.info('Auto Anime Bot Started!')
     sch.start()
-    bot_loop.create_task(queue_loop())
+    await resume_animes()
     await fetch_animes()
     await idle()
     LOGS.info('Auto Anime Bot Stopped!')
     await bot.stop()
+    await http.close()
+    tor_session.save()
     for task in all_tasks:
         task.cancel()
-    await clean_up()
+    await clean_up(await journal.keep_paths())
     LOGS.info('Finished AutoCleanUp !!')
     
 if __name__ == '__main__':
@@ -0,0 +1,68 @@
+from os import path as ospath, cpu_count
+from math import ceil, sqrt
+from asyncio import gather, Semaphore, create_subprocess_exec
+from asyncio.subprocess import DEVNULL
+from aiofiles.os import makedirs as aiomakedirs
+from aioshutil import rmtree as aiormtree
+from pyrogram.types import InputMediaPhoto
+
+from bot import bot, Var, LOGS
+from .probe import prober
+from .reporter import rep
+
+
+async def run_quiet(*args):
+    proc = await create_subprocess_exec(*args, stdout=DEVNULL, stderr=DEVNULL)
+    return await proc.wait()
+
+async def take_screenshots(src, out_dir, count=10):
+    """One short ffmpeg per timestamp with -ss before -i, so each seeks straight to the preceding keyframe and decodes only up to its frame."""
+    duration = await prober.duration(src)
+    stamps = [duration * (0.05 + 0.9 * i / max(count - 1, 1)) for i in range(count)]
+    limit = Semaphore(max(1, (cpu_count() or 1) // 2))
+    async def shot(i, stamp):
+        out = ospath.join(out_dir, f"ss_{i:02d}.jpg")
+        async with limit:
+            code = await run_quiet("ffmpeg", "-y", "-ss", f"{stamp:.3f}", "-i", src, "-map", "0:v:0", "-frames:v", "1", "-q:v", "2", out)
+        return out if code == 0 and ospath.exists(out) else None
+    return [out for out in await gather(*(shot(i, stamp) for i, stamp in enumerate(stamps))) if out]
+
+async def make_contact_sheet(shots, out_dir):
+    if not shots:
+        return None
+    cols = ceil(sqrt(len(shots)))
+    rows = ceil(len(shots) / cols)
+    out = ospath.join(out_dir, "sheet.jpg")
+    code = await run_quiet("ffmpeg", "-y", "-framerate", "1", "-pattern_type", "glob", "-i", ospath.join(out_dir, "ss_*.jpg"), "-vf", f"scale=480:-2,tile={cols}x{rows}:padding=4:margin=4", "-frames:v", "1", "-q:v", "3", out)
+    return out if code == 0 and ospath.exists(out) else None
+
+async def cut_sample(src, out_dir, seconds=30):
+    """Stream copy a sample from the keyframe nearest a fifth of the way in, so no frame is decoded."""
+    duration = await prober.duration(src)
+    target = duration / 5
+    start = min(await prober.keyframes(src) or [target], key=lambda kf: abs(kf - target))
+    out = ospath.join(out_dir, "sample.mkv")
+    code = await run_quiet("ffmpeg", "-y", "-ss", f"{start:.3f}", "-i", src, "-t", str(seconds), "-map", "0:v:0", "-map", "0:a?", "-map", "0:s?", "-c", "copy", out)
+    return out if code == 0 and ospath.exists(out) and ospath.getsize(out) > 0 else None
+
+async def make_addons(src, out_dir):
+    await aiomakedirs(out_dir, exist_ok=True)
+    shots, sample = await gather(take_screenshots(src, out_dir, Var.SS_COUNT), cut_sample(src, out_dir, Var.SAMPLE_SECS))
+    return shots, await make_contact_sheet(shots, out_dir), sample
+
+async def send_addons(src, name, job_id):
+    """Screenshots, contact sheet and sample of the source, sent to ADDONS_CHAT off the encode and upload path."""
+    out_dir = ospath.join("encode", f"addons_{job_id}")
+    try:
+        shots, sheet, sample = await make_addons(src, out_dir)
+        if shots:
+            await bot.send_media_group(Var.ADDONS_CHAT, [InputMediaPhoto(shot, caption=f"<i>{name}</i>" if i == 0 else "") for i, shot in enumerate(shots[:10])])
+        if sheet:
+            await bot.send_photo(Var.ADDONS_CHAT, sheet, caption=f"<b>Contact Sheet :</b> <i>{name}</i>")
+        if sample:
+            await bot.send_document(Var.ADDONS_CHAT, sample, caption=f"<b>Sample :</b> <i>{name}</i>", force_document=True)
+    except Exception as e:
+        LOGS.error(f"Add-ons Failed for {name} : {e}")
+        await rep.report(f"Add-ons Failed for {name} : {e}", "warning")
+    finally:
+        await aiormtree(out_dir, ignore_errors=True)
@@ -0,0 +1,96 @@
+from re import sub
+from time import time
+from collections import OrderedDict
+
+from bot import Var
+from .database import db
+
+
+class MetaCache:
+    def __init__(self, size=256):
+        self.__lru = OrderedDict()
+        self.__size = size
+
+    @staticmethod
+    def normalize(title):
+        return sub(r"[^0-9a-z]+", " ", (title or "").lower()).strip()
+
+    def __remember(self, key, data, expires):
+        self.__lru[key] = (data, expires)
+        self.__lru.move_to_end(key)
+        while len(self.__lru) > self.__size:
+            self.__lru.popitem(last=False)
+
+    async def get(self, key):
+        """Return (hit, data) for key, an empty data on hit is a cached miss."""
+        now = time()
+        if (item := self.__lru.get(key)):
+            if item[1] > now:
+                self.__lru.move_to_end(key)
+                return True, item[0]
+            del self.__lru[key]
+        metaset = await db.getAniMeta(key)
+        if metaset and metaset.get('expires', 0) > now:
+            self.__remember(key, metaset.get('data') or {}, metaset['expires'])
+            return True, metaset.get('data') or {}
+        return False, None
+
+    async def set(self, key, data, ttl=None):
+        data = data or {}
+        expires = time() + (ttl or (Var.META_TTL if data else Var.META_NEG_TTL))
+        self.__remember(key, data, expires)
+        await db.saveAniMeta(key, data, expires)
+
+    async def get_title(self, title):
+        return await self.get(f"title:{self.normalize(title)}")
+
+    async def set_title(self, title, data, ttl=None):
+        await self.set(f"title:{self.normalize(title)}", data, ttl)
+        if data and (ani_id := data.get('id')):
+            await self.set(f"id:{ani_id}", data)
+
+    async def get_id(self, ani_id):
+        return await self.get(f"id:{ani_id}")
+
+
+class AliasIndex:
+    def __init__(self):
+        self.__aliases = None
+
+    async def __load(self):
+        if self.__aliases is None:
+            self.__aliases = await db.getAliases()
+        return self.__aliases
+
+    async def resolve(self, title):
+        if (alias := (await self.__load()).get(MetaCache.normalize(title))):
+            return alias['ani_id']
+
+    async def get(self, title):
+        return (await self.__load()).get(MetaCache.normalize(title))
+
+    async def record(self, titles, ani_id):
+        aliases = await self.__load()
+        for title in titles:
+            if not (alias := MetaCache.normalize(title)):
+                continue
+            if (old := aliases.get(alias)) and (old.get('manual') or old['ani_id'] == ani_id):
+                continue
+            aliases[alias] = {'_id': alias, 'ani_id': ani_id, 'manual': False}
+            await db.saveAlias(alias, ani_id)
+
+    async def set(self, title, ani_id):
+        alias = MetaCache.normalize(title)
+        (await self.__load())[alias] = {'_id': alias, 'ani_id': ani_id, 'manual': True}
+        await db.saveAlias(alias, ani_id, manual=True)
+        return alias
+
+    async def remove(self, title):
+        alias = MetaCache.normalize(title)
+        if (await self.__load()).pop(alias, None) is None:
+            return None
+        await db.delAlias(alias)
+        return alias
+
+anicache = MetaCache(Var.META_LRU)
+aliases = AliasIndex()
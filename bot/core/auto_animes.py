@@ -1,19 +1,30 @@
-from asyncio import gather, create_task, sleep as asleep, Event
+from asyncio import gather, create_task, sleep as asleep
 from asyncio.subprocess import PIPE
 from os import path as ospath, system
 from aiofiles import open as aiopen
 from aiofiles.os import remove as aioremove
+from aioshutil import rmtree as aiormtree
 from traceback import format_exc
 from base64 import urlsafe_b64encode
 from time import time
+from math import floor
 from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 
-from bot import bot, bot_loop, Var, ani_cache, ffQueue, ffLock, ff_queued
+from bot import bot, bot_loop, Var, ani_cache, upSlots, upBacklog
 from .tordownload import TorDownloader
 from .database import db
-from .func_utils import getfeed, encode, editMessage, sendMessage, convertBytes
+from .mediacache import mediacache
+from .feedreader import feeds, poller
+from .func_utils import encode, editMessage, sendMessage, convertBytes, convertTime
 from .text_utils import TextEditor
-from .ffencoder import FFEncoder
+from .ffencoder import FFEncoder, ffargs
+from .ffqueue import ffsched, encode_priority
+from .probe import prober
+from .jobqueue import jobqueue
+from .outcache import outcache
+from .journal import journal
+from .addons import send_addons
+from .storage import storage, path_size, rendition_estimate
 from .tguploader import TgUploader
 from .reporter import rep
 
@@ -27,10 +38,12 @@ btn_formatter = {
 async def fetch_animes():
     await rep.report("Fetch Animes Started !!", "info")
     while True:
-        await asleep(60)
+        await poller.refresh()
+        await asleep(poller.next_interval())
         if ani_cache['fetch_animes']:
             for link in Var.RSS_ITEMS:
-                if (info := await getfeed(link, 0)):
+                for info in await feeds.fetch_new(link):
+                    poller.mark_released(info.title)
                     bot_loop.create_task(get_animes(info.title, info.link))
 
 async def get_animes(name, torrent, force=False):
@@ -52,84 +65,272 @@ async def get_animes(name, torrent, force=False):
                 await rep.report(f"Torrent Skipped!\n\n{name}", "warning")
                 return
 
-            await rep.report(f"New Anime Torrent Found!\n\n{name}", "info")
-            post_msg = await bot.send_photo(
-                Var.MAIN_CHANNEL,
-                photo=await aniInfo.get_poster(),
-                caption=await aniInfo.get_caption()
-            )
-            #post_msg = await sendMessage(Var.MAIN_CHANNEL, (await aniInfo.get_caption()).format(await aniInfo.get_poster()), invert_media=True)
+            src_key = outcache.source_key(torrent)
+            job = await journal.start(src_key, name, torrent, force, ani_id, ep_no)
+            if (post_msg := await get_post(job.get('post_id'))):
+                await rep.report(f"Resuming Anime Torrent from {job['stage'].title()} Stage!\n\n{name}", "info")
+            else:
+                await rep.report(f"New Anime Torrent Found!\n\n{name}", "info")
+                post_msg = await mediacache.send_poster(Var.MAIN_CHANNEL, aniInfo, await aniInfo.get_caption())
+                #post_msg = await sendMessage(Var.MAIN_CHANNEL, (await aniInfo.get_caption()).format(await aniInfo.get_poster()), invert_media=True)
+                await journal.update(src_key, post_id=post_msg.id)
 
-            await asleep(1.5)
-            stat_msg = await sendMessage(Var.MAIN_CHANNEL, f"‣ <b>Anime Name :</b> <b><i>{name}</i></b>\n\n<i>Downloading...</i>")
-            dl = await TorDownloader("./downloads").download(torrent, name)
-            if not dl or not ospath.exists(dl):
-                await rep.report(f"File Download Incomplete, Try Again", "error")
-                await stat_msg.delete()
+            ckeys = {qual: outcache.key(src_key, qual) for qual in Var.QUALS}
+            uploaded = {qual: msg for qual in Var.QUALS if (msg := await outcache.get_msg(ckeys[qual]))}
+            # Link cached encodes into encode/ now, so an eviction later can't take them from under the job
+            restored, need = {}, []
+            for qual in Var.QUALS:
+                if qual in uploaded or journal.encoded(src_key, qual):
+                    continue
+                if (out_path := await outcache.restore(ckeys[qual], ospath.join("encode", await aniInfo.get_upname(qual)))):
+                    restored[qual] = out_path
+                else:
+                    need.append(qual)
+            if len(uploaded) == len(Var.QUALS):
+                await rep.report(f"All Renditions Found in Encode Cache, Posting...\n\n{name}", "info")
+                btns = {}
+                for qual in Var.QUALS:
+                    await post_rendition(post_msg, uploaded[qual], qual, btns, ani_id, ep_no)
+                await journal.finish(src_key)
+                ani_cache['completed'].add(ani_id)
                 return
 
-            post_id = post_msg.id
-            ffEvent = Event()
-            ff_queued[post_id] = ffEvent
-            if ffLock.locked():
-                await editMessage(stat_msg, f"‣ <b>Anime Name :</b> <b><i>{name}</i></b>\n\n<i>Queued to Encode...</i>")
-                await rep.report("Added Task to Queue...", "info")
-            await ffQueue.put(post_id)
-            await ffEvent.wait()
-
-            await ffLock.acquire()
-            btns = []
-            for qual in Var.QUALS:
-                filename = await aniInfo.get_upname(qual)
-                await editMessage(stat_msg, f"‣ <b>Anime Name :</b> <b><i>{name}</i></b>\n\n<i>Ready to Encode...</i>")
-
-                await asleep(1.5)
-                await rep.report("Starting Encode...", "info")
-                try:
-                    out_path = await FFEncoder(stat_msg, dl, filename, qual).start_encode()
-                except Exception as e:
-                    await rep.report(f"Error: {e}, Cancelled,  Retry Again !", "error")
-                    await stat_msg.delete()
-                    ffLock.release()
-                    return
-                await rep.report("Succesfully Compressed Now Going To Upload...", "info")
-
-                await editMessage(stat_msg, f"‣ <b>Anime Name :</b> <b><i>{filename}</i></b>\n\n<i>Ready to Upload...</i>")
-                await asleep(1.5)
-                try:
-                    msg = await TgUploader(stat_msg).upload(out_path, qual)
-                except Exception as e:
-                    await rep.report(f"Error: {e}, Cancelled,  Retry Again !", "error")
+            await asleep(1.5)
+            stat_msg = await sendMessage(Var.MAIN_CHANNEL, f"‣ <b>Anime Name :</b> <b><i>{name}</i></b>\n\n<i>Downloading...</i>")
+            dl, stream, downloaded = None, None, None
+            if need and not (dl := journal.source(src_key)):
+                # Each job downloads into its own dir so its reservation can follow the bytes written
+                dl_dir = ospath.join("downloads", str(post_msg.id))
+                await storage.reserve(src_key, Var.DISK_EST_SOURCE_MB * 1024 ** 2, [dl_dir], on_wait=lambda: editMessage(stat_msg, f"‣ <b>Anime Name :</b> <b><i>{name}</i></b>\n\n<i>Waiting for Disk Space...</i>"))
+                tordl = TorDownloader(dl_dir)
+                if Var.STREAM_INGEST and not Var.MULTI_ENCODE and not jobqueue:
+                    # Streaming ingest: encode the first rendition from the file while it downloads
+                    if (stream := await tordl.stream(torrent, name, priority=not force)):
+                        dl = stream.path
+                        downloaded = bot_loop.create_task(finish_stream(stream, src_key))
+                else:
+                    dl = await tordl.download(torrent, name, dl_progress(stat_msg, name), priority=not force)
+                if not dl or not ospath.exists(dl):
                     await stat_msg.delete()
-                    ffLock.release()
+                    await journal.release(src_key)
+                    if tordl.stalled and job['attempts'] < Var.JOB_RETRIES:
+                        await rep.report(f"Download Stalled, Requeued in {convertTime(Var.STALL_REQUEUE)}\n\n{name}", "warning")
+                        bot_loop.create_task(requeue_anime(ani_id, name, torrent, force))
+                    else:
+                        await rep.report(f"File Download Incomplete, Try Again", "error")
                     return
-                await rep.report("Succesfully Uploaded File into Tg...", "info")
+                if not stream:
+                    await journal.update(src_key, stage='downloaded', dl=dl)
+            addons = bot_loop.create_task(send_addons(dl, name, post_msg.id)) if Var.ADDONS and dl and not downloaded else None
 
-                msg_id = msg.id
-                link = f"https://telegram.me/{(await bot.get_me()).username}?start={await encode('get-'+str(msg_id * abs(Var.FILE_STORE)))}"
+            post_id = post_msg.id
+            if need:
+                src_info = await prober.probe(dl)
+                await storage.reserve(src_key, rendition_estimate(stream.size if stream else path_size(dl), src_info.height, need), [ospath.join(Var.JOB_OUT_DIR if jobqueue else "encode", await aniInfo.get_upname(qual)) for qual in need], on_wait=lambda: editMessage(stat_msg, f"‣ <b>Anime Name :</b> <b><i>{name}</i></b>\n\n<i>Waiting for Disk Space...</i>"))
+                # Remote encodes are queued for the workers and never hold a local encode slot
+                if not jobqueue:
+                    if ffsched.locked():
+                        await editMessage(stat_msg, f"‣ <b>Anime Name :</b> <b><i>{name}</i></b>\n\n<i>Queued to Encode...</i>")
+                        await rep.report("Added Task to Queue...", "info")
+                    await ffsched.acquire(post_id, name, encode_priority(aniInfo.adata, ep_no, await prober.duration(dl), force))
+                await journal.update(src_key, stage='encoding')
 
-                if post_msg:
-                    if len(btns) != 0 and len(btns[-1]) == 1:
-                        btns[-1].insert(1, InlineKeyboardButton(f"{btn_formatter[qual]} - {convertBytes(msg.document.file_size)}", url=link))
+            up_tasks, btns, up_msg, encoded, streamed = {}, {}, None, True, False
+            try:
+                if (Var.MULTI_ENCODE or jobqueue) and need:
+                    await editMessage(stat_msg, f"‣ <b>Anime Name :</b> <b><i>{name}</i></b>\n\n<i>Ready to Encode...</i>")
+                    if jobqueue:
+                        await rep.report("Submitting All Renditions to Encode Workers...", "info")
+                        renditions = {qual: (await aniInfo.get_upname(qual), ffargs[qual]) for qual in need}
+                        out_paths = await jobqueue.encode(stat_msg, ospath.abspath(dl), name, renditions)
                     else:
-                        btns.append([InlineKeyboardButton(f"{btn_formatter[qual]} - {convertBytes(msg.document.file_size)}", url=link)])
-                    await editMessage(post_msg, post_msg.caption.html if post_msg.caption else "", InlineKeyboardMarkup(btns))
+                        await rep.report("Starting Multi-Rendition Encode...", "info")
+                        renditions = {qual: await aniInfo.get_upname(qual) for qual in need}
+                        out_paths = await FFEncoder(stat_msg, dl, name, None, post_id).start_multi_encode(renditions)
+                    for qual, out_path in out_paths.items():
+                        await journal.rendition(src_key, qual, 'encoded', out_path)
+                    if len(out_paths) != len(renditions):
+                        await rep.report(f"Error: Multi-Rendition Encode Failed for {', '.join(q for q in renditions if q not in out_paths)}p, Cancelled,  Retry Again !", "error")
+                        await stat_msg.delete()
+                        await journal.release(src_key)
+                        return
+                    await rep.report("Succesfully Compressed All Renditions Now Going To Upload...", "info")
 
-                await db.saveAnime(ani_id, ep_no, qual, post_id)
-                bot_loop.create_task(extra_utils(msg_id, out_path))
-            ffLock.release()
+                for qual in Var.QUALS:
+                    filename = await aniInfo.get_upname(qual)
+                    if qual in uploaded:
+                        await post_rendition(post_msg, uploaded[qual], qual, btns, ani_id, ep_no)
+                        await journal.rendition(src_key, qual, 'uploaded')
+                        continue
+                    if (out_path := journal.encoded(src_key, qual)):
+                        await rep.report(f"Reusing {qual}p Encode from Before Restart...", "info")
+                    elif (out_path := restored.get(qual)):
+                        await rep.report(f"Reusing Cached {qual}p Encode...", "info")
+                    elif Var.MULTI_ENCODE or jobqueue:
+                        out_path = out_paths[qual]
+                    else:
+                        await editMessage(stat_msg, f"‣ <b>Anime Name :</b> <b><i>{name}</i></b>\n\n<i>Ready to Encode...</i>")
+                        await rep.report("Starting Encode...", "info")
+                        try:
+                            if downloaded and not downloaded.done() and not streamed:
+                                streamed = True
+                                out_path = await FFEncoder(stat_msg, dl, filename, qual, post_id).start_stream_encode(stream)
+                            else:
+                                if downloaded:
+                                    await downloaded
+                                out_path = await FFEncoder(stat_msg, dl, filename, qual, post_id).start_encode()
+                        except Exception as e:
+                            await rep.report(f"Error: {e}, Cancelled,  Retry Again !", "error")
+                            out_path = None
+                        if not out_path:
+                            if out_path is not None:
+                                await rep.report(f"Error: {qual}p Encode Failed, Cancelled,  Retry Again !", "error")
+                            encoded = False
+                            break
+                        await journal.rendition(src_key, qual, 'encoded', out_path)
+                        await rep.report("Succesfully Compressed Now Going To Upload...", "info")
 
+                    # Backpressure: hold the encoder while too many finished renditions wait for upload
+                    await upBacklog.acquire()
+                    if up_msg is None:
+                        up_msg = await sendMessage(Var.MAIN_CHANNEL, f"‣ <b>Anime Name :</b> <b><i>{name}</i></b>\n\n<i>Queued to Upload...</i>")
+                    up_tasks[qual] = bot_loop.create_task(upload_rendition(post_msg, up_msg, out_path, qual, btns, ani_id, ep_no, ckeys[qual]))
+            finally:
+                if need:
+                    await FFEncoder.clean_job(post_id)
+                    ffsched.release(post_id)
+                if downloaded and not downloaded.done() and not encoded:
+                    downloaded.cancel()
+                    stream.close()
+
+            if encoded:
+                await editMessage(stat_msg, f"‣ <b>Anime Name :</b> <b><i>{name}</i></b>\n\n<i>Encoded, Waiting for Uploads...</i>")
+                if downloaded:
+                    await downloaded
+                    if Var.ADDONS:
+                        addons = bot_loop.create_task(send_addons(dl, name, post_msg.id))
+                if addons:
+                    await addons
+                if ospath.isdir(dl_dir := ospath.join("downloads", str(post_msg.id))):
+                    await aiormtree(dl_dir, ignore_errors=True)
+                elif dl:
+                    await aioremove(dl)
+            results = dict(zip(up_tasks, await gather(*up_tasks.values(), return_exceptions=True)))
+            for qual, res in results.items():
+                if res and not isinstance(res, BaseException):
+                    await journal.rendition(src_key, qual, 'uploaded')
             await stat_msg.delete()
-            await aioremove(dl)
+            if up_msg:
+                await up_msg.delete()
+            if not encoded:
+                await journal.release(src_key)
+                return
+            if (failed := [qual for qual, res in results.items() if isinstance(res, BaseException) or not res]):
+                await rep.report(f"Error: Upload Failed for {', '.join(failed)}p, Cancelled,  Retry Again !", "error")
+                await journal.release(src_key)
+                return
+            await journal.finish(src_key)
         ani_cache['completed'].add(ani_id)
     except Exception as error:
         await rep.report(format_exc(), "error")
+    finally:
+        await storage.release(outcache.source_key(torrent))
+
+def dl_progress(stat_msg, name):
+    last = [0]
+    async def progress(prog):
+        if time() - last[0] < 8 and not prog.finished:
+            return
+        last[0] = time()
+        percent = round(prog.done * 100 / prog.total, 2) if prog.total else 0
+        bar = floor(percent / 8) * "█" + (12 - floor(percent / 8)) * "▒"
+        stall = f"\n    ‣ <b>Stalled :</b> {convertTime(prog.stalled_for)} of {convertTime(Var.STALL_WINDOW)}" if prog.stalled_for >= 60 else ""
+        await editMessage(stat_msg, f"""‣ <b>Anime Name :</b> <b><i>{name}</i></b>
+
+‣ <b>Status :</b> <i>Downloading</i>
+    <code>[{bar}]</code> {percent}%
+    ‣ <b>Size :</b> {convertBytes(prog.done)} out of ~ {convertBytes(prog.total)}
+    ‣ <b>Speed :</b> {convertBytes(prog.rate) or '0 B'}/s
+    ‣ <b>Peers :</b> {prog.peers} ({prog.seeds} Seeds)
+    ‣ <b>Time Left :</b> {convertTime(prog.eta) or '-'}{stall}""")
+    return progress
+
+async def requeue_anime(ani_id, name, torrent, force):
+    await asleep(Var.STALL_REQUEUE)
+    ani_cache['ongoing'].discard(ani_id)
+    await get_animes(name, torrent, force)
+
+async def finish_stream(stream, src_key):
+    """Let a streamed download run to completion, then journal it like a regular download."""
+    path = await stream.wait()
+    stream.close()
+    await journal.update(src_key, stage='downloaded', dl=path)
+    return path
+
+async def resume_animes():
+    """Pick up the episodes a restart interrupted, from the stage the journal last recorded."""
+    for job in await journal.unfinished(exhausted=True):
+        if job.get('attempts', 0) >= Var.JOB_RETRIES:
+            # Out of retries, drop it so the next clean_up() frees its files
+            await rep.report(f"Giving Up on Anime Torrent After {job['attempts']} Attempts!\n\n{job['name']}", "warning")
+            await journal.finish(job['_id'])
+            continue
+        if job.get('ani_id') and (qual_data := (await db.getAnime(job['ani_id'])).get(job.get('ep_no'))) and all(qual_data.values()):
+            await journal.finish(job['_id'])
+            continue
+        bot_loop.create_task(get_animes(job['name'], job['torrent'], job.get('force', False)))
+
+async def get_post(post_id):
+    if not post_id:
+        return None
+    try:
+        if (msg := await bot.get_messages(Var.MAIN_CHANNEL, message_ids=post_id)) and not msg.empty:
+            return msg
+    except Exception:
+        pass
+    return None
+
+def make_btns(btns):
+    rows = []
+    for qual in Var.QUALS:
+        if (btn := btns.get(qual)):
+            if len(rows) != 0 and len(rows[-1]) == 1:
+                rows[-1].append(btn)
+            else:
+                rows.append([btn])
+    return rows
+
+async def upload_rendition(post_msg, up_msg, out_path, qual, btns, ani_id, ep_no, ckey=None):
+    try:
+        async with upSlots:
+            await editMessage(up_msg, f"‣ <b>Anime Name :</b> <b><i>{ospath.basename(out_path)}</i></b>\n\n<i>Ready to Upload...</i>")
+            if ckey:
+                await outcache.store(ckey, out_path)
+            msg = await TgUploader(up_msg).upload(out_path, qual)
+    finally:
+        upBacklog.release()
+    await rep.report("Succesfully Uploaded File into Tg...", "info")
+    if ckey:
+        await outcache.set_msg(ckey, msg)
+    return await post_rendition(post_msg, msg, qual, btns, ani_id, ep_no)
+
+async def post_rendition(post_msg, msg, qual, btns, ani_id, ep_no):
+    msg_id = msg.id
+    link = f"https://telegram.me/{(await bot.get_me()).username}?start={await encode('get-'+str(msg_id * abs(Var.FILE_STORE)))}"
+
+    if post_msg:
+        btns[qual] = InlineKeyboardButton(f"{btn_formatter[qual]} - {convertBytes((msg.document or msg.video).file_size)}", url=link)
+        await editMessage(post_msg, post_msg.caption.html if post_msg.caption else "", InlineKeyboardMarkup(make_btns(btns)))
+
+    await db.saveAnime(ani_id, ep_no, qual, post_msg.id)
+    bot_loop.create_task(extra_utils(msg_id))
+    return msg
 
-async def extra_utils(msg_id, out_path):
+async def extra_utils(msg_id):
     msg = await bot.get_messages(Var.FILE_STORE, message_ids=msg_id)
 
     if Var.BACKUP_CHANNEL != 0:
         for chat_id in Var.BACKUP_CHANNEL.split():
             await msg.copy(int(chat_id))
 
-    # MediaInfo, ScreenShots, Sample Video ( Add-ons Features )
\ No newline at end of file
+    # ScreenShots and Sample Video are made from the source by send_addons() ( Add-ons Features )
\ No newline at end of file
@@ -0,0 +1,111 @@
+from re import sub, search
+from time import time
+from os import path as ospath, cpu_count, makedirs, remove
+from asyncio import create_subprocess_exec, create_subprocess_shell
+from asyncio.subprocess import PIPE, DEVNULL
+
+from bot import Var, LOGS
+from .ffencoder import ffargs, progress_blocks, FFProgress
+from .probe import prober
+
+BENCH_DIR = "bench"
+
+
+def bench_threads():
+    cpus = cpu_count() or 1
+    return sorted({max(1, cpus // 4), max(1, cpus // 2), cpus})
+
+def tune_ffcode(ffcode, preset=None, threads=None):
+    """Rewrite an FFCODE template's -preset and -threads, leaving everything else as configured."""
+    if preset:
+        ffcode = sub(r"-preset \S+", f"-preset {preset}", ffcode) if "-preset" in ffcode else ffcode.replace("'{}' -y", f"-preset {preset} '{{}}' -y")
+    if threads:
+        ffcode = sub(r"-threads \d+ ", "", ffcode).replace("'{}' -y", f"-threads {threads} '{{}}' -y")
+    return ffcode
+
+
+class EncodeBenchmark:
+    def __init__(self, seconds=20, presets=None, threads=None):
+        self.seconds = seconds
+        self.presets = presets or Var.BENCH_PRESETS
+        self.threads = threads or bench_threads()
+        self.results = {}
+
+    async def make_clip(self):
+        """A reproducible anime-like reference: flat coloured shapes with hard edges and motion from testsrc2, plus a stereo tone, generated by lavfi."""
+        makedirs(BENCH_DIR, exist_ok=True)
+        clip = ospath.join(BENCH_DIR, f"ref_{self.seconds}s.mkv")
+        if not ospath.exists(clip):
+            proc = await create_subprocess_exec("ffmpeg", "-y", "-f", "lavfi", "-i", f"testsrc2=size=1920x1080:rate=24000/1001:duration={self.seconds}",
+                                                "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=48000:duration={self.seconds}",
+                                                "-c:v", "libx264", "-preset", "ultrafast", "-qp", "0", "-pix_fmt", "yuv420p", "-c:a", "flac", "-ac", "2", clip,
+                                                stdout=DEVNULL, stderr=PIPE)
+            _, stderr = await proc.communicate()
+            if proc.returncode != 0:
+                raise ValueError(f"Reference Clip Generation Failed : {stderr.decode(errors='ignore')[-500:]}")
+        return clip
+
+    @staticmethod
+    async def ssim(out_path, ref_path):
+        info = await prober.probe(out_path)
+        proc = await create_subprocess_exec("ffmpeg", "-i", out_path, "-i", ref_path, "-lavfi", f"[1:v]scale={info.width}:{info.height}[ref];[0:v][ref]ssim", "-f", "null", "-", stdout=DEVNULL, stderr=PIPE)
+        _, stderr = await proc.communicate()
+        return float(match.group(1)) if (match := search(r"All:([0-9.]+)", stderr.decode(errors="ignore"))) else 0.0
+
+    async def run_one(self, ref, qual, ffcode):
+        out_path = ospath.join(BENCH_DIR, f"out_{qual}.mkv")
+        start, last = time(), FFProgress()
+        proc = await create_subprocess_shell(ffcode.format(ref, "pipe:1", out_path), stdout=PIPE, stderr=DEVNULL)
+        async for prog in progress_blocks(proc.stdout):
+            last = prog
+        if await proc.wait() != 0 or not ospath.exists(out_path):
+            return None
+        took = time() - start
+        result = {
+            'fps': last.frame / took if took else 0.0,
+            'speed': self.seconds / took if took else 0.0,
+            'size': ospath.getsize(out_path),
+            'ssim': await self.ssim(out_path, ref),
+        }
+        remove(out_path)
+        return result
+
+    async def run(self, progress=None):
+        """Encode the reference with every FFCODE rendition under each preset and thread count. Returns {qual: {(preset, threads): result}}, the configured template stored under (None, None)."""
+        ref = await self.make_clip()
+        for qual in Var.QUALS:
+            self.results[qual] = {}
+            for preset, threads in [(None, None)] + [(p, t) for p in self.presets for t in self.threads]:
+                if progress:
+                    await progress(f"{qual}p : {preset or 'configured'} preset, {threads or 'default'} threads")
+                if (result := await self.run_one(ref, qual, tune_ffcode(ffargs[qual], preset, threads))):
+                    self.results[qual][(preset, threads)] = result
+                else:
+                    LOGS.warning(f"Benchmark Encode Failed for {qual}p {preset}/{threads}")
+        return self.results
+
+    def best(self, qual):
+        """Fastest setting whose output stays within BENCH_SLACK of the configured template's size."""
+        results = self.results.get(qual, {})
+        if not (base := results.get((None, None))):
+            return (None, None), None
+        budget = base['size'] * Var.BENCH_SLACK
+        fits = [(setting, res) for setting, res in results.items() if setting != (None, None) and res['size'] <= budget]
+        return max(fits, key=lambda item: item[1]['fps'], default=((None, None), base))
+
+    def report(self):
+        txt = f"<b>Encoder Benchmark</b> ({self.seconds}s 1080p lavfi clip)\n"
+        for qual, results in self.results.items():
+            if not results:
+                txt += f"\n<b>{qual}p :</b> <i>All Encodes Failed</i>\n"
+                continue
+            txt += f"\n<b>{qual}p</b>\n"
+            shown = [(None, None)] + [setting for setting, _ in sorted(results.items(), key=lambda item: -item[1]['fps']) if setting != (None, None)][:4]
+            for (preset, threads), res in ((setting, results[setting]) for setting in shown if setting in results):
+                txt += f"  • <code>{preset or 'configured'}/{threads or '-'}</code> : {res['fps']:.1f} fps, {res['speed']:.2f}x, {res['size'] / 1024:.0f} KiB, SSIM {res['ssim']:.4f}\n"
+            (preset, threads), res = self.best(qual)
+            if res is None:
+                txt += "  ➜ <i>Configured Template Failed, No Size Budget</i>\n"
+                continue
+            txt += f"  ➜ <b>Best :</b> <code>{preset or 'configured'}" + (f" -threads {threads}" if threads else "") + f"</code> ({res['fps']:.1f} fps, SSIM {res['ssim']:.4f})\n"
+        return txt
@@ -1,4 +1,5 @@
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
 from bot import Var
 
 class MongoDB:
@@ -6,17 +7,102 @@ class MongoDB:
         self.__client = AsyncIOMotorClient(uri)
         self.__db = self.__client[database_name]
         self.__animes = self.__db.animes[Var.BOT_TOKEN.split(':')[0]]
+        self.__feeds = self.__db.feeds[Var.BOT_TOKEN.split(':')[0]]
+        self.__anilist = self.__db.anilist
+        self.__aliases = self.__db.aliases
+        self.__media = self.__db.media[Var.BOT_TOKEN.split(':')[0]]
+        self.__jobs = self.__db.encode_jobs[Var.BOT_TOKEN.split(':')[0]]
+        self.__encodes = self.__db.encodes[Var.BOT_TOKEN.split(':')[0]]
+        self.__journal = self.__db.journal[Var.BOT_TOKEN.split(':')[0]]
 
     async def getAnime(self, ani_id):
         botset = await self.__animes.find_one({'_id': ani_id})
         return botset or {}
 
     async def saveAnime(self, ani_id, ep, qual, post_id=None):
-        quals = (await self.getAnime(ani_id)).get(ep, {qual: False for qual in Var.QUALS})
-        quals[qual] = True
-        await self.__animes.update_one({'_id': ani_id}, {'$set': {ep: quals}}, upsert=True)
+        # One pipeline update so renditions posted concurrently never overwrite each other's flag
+        fields = {ep: {'$mergeObjects': [{q: False for q in Var.QUALS}, f"${ep}", {qual: True}]}}
         if post_id:
-            await self.__animes.update_one({'_id': ani_id}, {'$set': {"msg_id": post_id}}, upsert=True)
+            fields['msg_id'] = post_id
+        await self.__animes.update_one({'_id': ani_id}, [{'$set': fields}], upsert=True)
+
+    async def getFeed(self, link):
+        feedset = await self.__feeds.find_one({'_id': link})
+        return feedset or {}
+
+    async def saveFeed(self, link, etag, modified, seen):
+        await self.__feeds.update_one({'_id': link}, {'$set': {'etag': etag, 'modified': modified, 'seen': seen}}, upsert=True)
+
+    async def getAniMeta(self, key):
+        metaset = await self.__anilist.find_one({'_id': key})
+        return metaset or {}
+
+    async def saveAniMeta(self, key, data, expires):
+        await self.__anilist.update_one({'_id': key}, {'$set': {'data': data, 'expires': expires}}, upsert=True)
+
+    async def getAliases(self):
+        return {doc['_id']: doc async for doc in self.__aliases.find({})}
+
+    async def saveAlias(self, alias, ani_id, manual=False):
+        await self.__aliases.update_one({'_id': alias}, {'$set': {'ani_id': ani_id, 'manual': manual}}, upsert=True)
+
+    async def delAlias(self, alias):
+        await self.__aliases.delete_one({'_id': alias})
+
+    async def getMedia(self, key):
+        mediaset = await self.__media.find_one({'_id': key})
+        return mediaset or {}
+
+    async def saveMedia(self, key, file_id, expires):
+        await self.__media.update_one({'_id': key}, {'$set': {'file_id': file_id, 'expires': expires}}, upsert=True)
+
+    async def delMedia(self, key):
+        await self.__media.delete_one({'_id': key})
+
+    async def putJob(self, job):
+        await self.__jobs.insert_one(job)
+
+    async def getJob(self, job_id):
+        jobset = await self.__jobs.find_one({'_id': job_id})
+        return jobset or {}
+
+    async def claimJob(self, worker, lease, now, max_tries):
+        return await self.__jobs.find_one_and_update(
+            {'$or': [{'status': 'queued'}, {'status': 'leased', 'lease_until': {'$lt': now}}], 'attempts': {'$lt': max_tries}},
+            {'$set': {'status': 'leased', 'worker': worker, 'lease_until': now + lease}, '$inc': {'attempts': 1}},
+            sort=[('created', 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def updateJob(self, job_id, fields, worker=None):
+        query = {'_id': job_id, 'worker': worker} if worker else {'_id': job_id}
+        return (await self.__jobs.update_one(query, {'$set': fields})).matched_count > 0
+
+    async def getEncode(self, key):
+        encset = await self.__encodes.find_one({'_id': key})
+        return encset or {}
+
+    async def saveEncode(self, key, fields):
+        await self.__encodes.update_one({'_id': key}, {'$set': fields}, upsert=True)
+
+    async def getEncodes(self):
+        return [doc async for doc in self.__encodes.find({'path': {'$ne': None}}).sort('used', 1)]
+
+    async def getJournal(self, key):
+        jobset = await self.__journal.find_one({'_id': key})
+        return jobset or {}
+
+    async def saveJournal(self, key, fields, inc=None):
+        update = {'$set': fields}
+        if inc:
+            update['$inc'] = inc
+        await self.__journal.update_one({'_id': key}, update, upsert=True)
+
+    async def getJournals(self):
+        return [doc async for doc in self.__journal.find({'stage': {'$ne': 'done'}}).sort('created', 1)]
+
+    async def delJournal(self, key):
+        await self.__journal.delete_one({'_id': key})
 
     async def reboot(self):
         await self.__animes.drop()
@@ -0,0 +1,122 @@
+from re import search
+from datetime import datetime, timedelta, timezone
+from json import loads as jloads
+from traceback import format_exc
+from feedparser import parse as feedparse
+
+from bot import LOGS, Var
+from .database import db
+from .func_utils import sync_to_async
+from .http_client import http
+
+
+class FeedReader:
+    def __init__(self, max_seen=500):
+        self.__states = {}
+        self.__max_seen = max_seen
+
+    @staticmethod
+    def entry_key(entry):
+        if (infohash := entry.get('nyaa_infohash')):
+            return infohash.lower()
+        if (mag := search(r"btih:([0-9a-zA-Z]+)", entry.get('link', ''))):
+            return mag.group(1).lower()
+        return entry.get('id') or entry.get('link')
+
+    async def __get_state(self, link):
+        if link not in self.__states:
+            feedset = await db.getFeed(link)
+            self.__states[link] = {
+                'etag': feedset.get('etag'),
+                'modified': feedset.get('modified'),
+                'seen': list(feedset.get('seen', []))
+            }
+        return self.__states[link]
+
+    async def fetch_new(self, link):
+        """Return unseen entries of the feed, oldest first. Uses a conditional GET so unchanged feeds are not re-parsed."""
+        state = await self.__get_state(link)
+        try:
+            feed = await sync_to_async(feedparse, link, etag=state['etag'], modified=state['modified'])
+        except Exception:
+            LOGS.error(format_exc())
+            return []
+
+        if feed.get('status') == 304:
+            return []
+        if not feed.entries:
+            if feed.get('bozo'):
+                LOGS.warning(f"Feed Parse Failed for {link} : {feed.get('bozo_exception')}")
+            return []
+
+        first_run = len(state['seen']) == 0
+        seen = set(state['seen'])
+        new_entries = []
+        for entry in feed.entries:
+            if (key := self.entry_key(entry)) and key not in seen:
+                seen.add(key)
+                new_entries.append((key, entry))
+
+        etag, modified = feed.get('etag'), feed.get('modified')
+        if new_entries or (etag, modified) != (state['etag'], state['modified']):
+            state['etag'], state['modified'] = etag, modified
+            limit = max(self.__max_seen, 2 * len(feed.entries))
+            state['seen'] = ([key for key, _ in new_entries] + state['seen'])[:limit]
+            await db.saveFeed(link, etag, modified, state['seen'])
+
+        if first_run:
+            # Fresh index, only pick up the latest release and mark the backlog as seen
+            new_entries = new_entries[:1]
+        return [entry for _, entry in reversed(new_entries)]
+
+SCHEDULE_TZ = ("Asia/Kolkata", timezone(timedelta(hours=5, minutes=30)))
+
+async def get_schedule():
+    try:
+        _, res, _ = await http.request('subsplease', 'GET', f"https://subsplease.org/api/?f=schedule&h=true&tz={SCHEDULE_TZ[0]}", resp_type="text")
+        return jloads(res)["schedule"]
+    except Exception:
+        LOGS.error(format_exc())
+        return None
+
+
+class PollScheduler:
+    def __init__(self):
+        self.__slots = []
+        self.__day = None
+
+    async def refresh(self):
+        today = datetime.now(SCHEDULE_TZ[1]).date()
+        if self.__day == today or (schedule := await get_schedule()) is None:
+            return
+        self.__day = today
+        self.__slots = []
+        for item in schedule:
+            try:
+                hr, mn = map(int, item["time"].split(":"))
+            except (KeyError, ValueError):
+                continue
+            at = datetime(today.year, today.month, today.day, hr, mn, tzinfo=SCHEDULE_TZ[1])
+            self.__slots.append((at, item.get("title", "")))
+        LOGS.info(f"Poll Scheduler Loaded {len(self.__slots)} Releases for {today}")
+
+    def mark_released(self, name):
+        lname = name.lower()
+        self.__slots = [(at, title) for at, title in self.__slots if not title or title.lower() not in lname]
+
+    def next_interval(self):
+        """Seconds to sleep before the next poll: fast inside a release window, idle otherwise."""
+        if self.__day is None:
+            return min(60, Var.POLL_IDLE)
+        now = datetime.now(SCHEDULE_TZ[1])
+        before, after = timedelta(seconds=Var.POLL_BEFORE), timedelta(seconds=Var.POLL_AFTER)
+        wait = Var.POLL_IDLE
+        for at, _ in self.__slots:
+            if at - before <= now <= at + after:
+                return Var.POLL_FAST
+            if now < at - before:
+                wait = min(wait, (at - before - now).total_seconds())
+        return max(Var.POLL_FAST, wait)
+
+feeds = FeedReader()
+poller = PollScheduler()
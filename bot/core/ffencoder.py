@@ -1,15 +1,17 @@
-from re import findall
 from math import floor
 from time import time
-from os import path as ospath
+from collections import deque
+from dataclasses import dataclass
+from os import path as ospath, cpu_count, symlink, remove
 from aiofiles import open as aiopen
-from aiofiles.os import remove as aioremove, rename as aiorename
-from shlex import split as ssplit
-from asyncio import sleep as asleep, gather, create_subprocess_shell, create_task
+from aiofiles.os import rename as aiorename, makedirs as aiomakedirs
+from aioshutil import rmtree as aiormtree
+from asyncio import gather, create_subprocess_shell, create_subprocess_exec, create_task
 from asyncio.subprocess import PIPE
 
 from bot import Var, bot_loop, ffpids_cache, LOGS
-from .func_utils import mediainfo, convertBytes, convertTime, sendMessage, editMessage
+from .func_utils import convertBytes, convertTime, sendMessage, editMessage
+from .probe import prober
 from .reporter import rep
 
 ffargs = {
@@ -19,90 +21,349 @@ ffargs = {
     '360': Var.FFCODE_360,
 }
 
+ffheights = {
+    '1080': 1080,
+    '720': 720,
+    '480': 480,
+    '360': 360,
+}
+
+ffmetrics = {}
+
+@dataclass
+class FFProgress:
+    out_time: float = 0.0
+    fps: float = 0.0
+    speed: float = 0.0
+    total_size: int = 0
+    bitrate: float = 0.0
+    frame: int = 0
+    done: bool = False
+
+    @classmethod
+    def from_block(cls, block):
+        """Build a record from one `-progress` key=value block, ignoring fields ffmpeg reports as N/A."""
+        def num(key, cast=float):
+            try:
+                return cast(block.get(key, "0").rstrip("xkbits/"))
+            except ValueError:
+                return cast(0)
+        return cls(
+            out_time=num("out_time_us", int) / 1000000 if "out_time_us" in block else num("out_time_ms", int) / 1000000,
+            fps=num("fps"),
+            speed=num("speed"),
+            total_size=num("total_size", int),
+            bitrate=num("bitrate"),
+            frame=num("frame", int),
+            done=block.get("progress") == "end",
+        )
+
+def encode_profile(qual):
+    """The encode settings a rendition of qual is produced with under the current config."""
+    if Var.MULTI_ENCODE:
+        return f"scale=-2:{ffheights[qual]} {Var.FF_VOPTS} {Var.FF_AOPTS}"
+    copy = f" copy:{','.join(Var.COPY_CODECS)}<={Var.COPY_MAX_KBPS}k {Var.FF_AOPTS}" if qual in Var.COPY_QUALS else ""
+    if Var.SEGMENT_ENCODE > 1 and qual in ffheights:
+        return f"scale=-2:{ffheights[qual]} {Var.FF_VOPTS} {Var.FF_AOPTS}{copy}"
+    return ffargs[qual] + copy
+
+def copy_ok(info, qual, ffcode):
+    """Whether the probed source can be stream copied as the qual rendition: no video filters in the template, a COPY_CODECS 8-bit 4:2:0 video already at the target height and within COPY_MAX_KBPS."""
+    if qual not in Var.COPY_QUALS or qual not in ffheights or any(f in ffcode for f in ("-vf", "-filter_complex", "-lavfi", "overlay", "subtitles=")):
+        return False
+    video = next((st for st in info.streams if st.get('codec_type') == "video" and not st.get('disposition', {}).get('attached_pic')), None)
+    if not video or video.get('codec_name') not in Var.COPY_CODECS or video.get('pix_fmt') not in ("yuv420p", "yuvj420p"):
+        return False
+    try:
+        kbps = int(video.get('bit_rate') or video.get('tags', {}).get('BPS') or video.get('tags', {}).get('BPS-eng') or info.bitrate) / 1000
+    except (TypeError, ValueError):
+        kbps = info.bitrate / 1000
+    return info.height == ffheights[qual] and 0 < kbps <= Var.COPY_MAX_KBPS
+
+def multi_ffcode(in_path, prog_file, outputs):
+    """Single ffmpeg command decoding the source once and scaling a split of it into every (qual, out_path) output."""
+    graph = f"[0:v:0]split={len(outputs)}" + "".join(f"[v{i}]" for i in range(len(outputs))) + ";" \
+        + ";".join(f"[v{i}]scale=-2:{ffheights[qual]}[o{i}]" for i, (qual, _) in enumerate(outputs))
+    ffcode = f"ffmpeg -i '{in_path}' -progress '{prog_file}' -filter_complex '{graph}'"
+    for i, (_, out_path) in enumerate(outputs):
+        ffcode += f" -map '[o{i}]' -map '0:a?' -map '0:s?' -map '0:t?' {Var.FF_VOPTS} {Var.FF_AOPTS} -c:s copy -c:t copy '{out_path}'"
+    return ffcode + " -y"
+
+def with_threads(ffcode, out_paths, share=1):
+    """Split the CPU between encode slots (and `share` parallel processes per slot) by giving each output an equal -threads budget, unless the template sets its own."""
+    if Var.ENCODE_SLOTS * share <= 1 or "-threads" in ffcode:
+        return ffcode
+    threads = max(1, (cpu_count() or 1) // (Var.ENCODE_SLOTS * share))
+    for out_path in out_paths:
+        ffcode = ffcode.replace(f"'{out_path}'", f"-threads {threads} '{out_path}'")
+    return ffcode
+
+def segment_times(keyframes, total_time, count):
+    """Keyframe timestamps closest to an even split of the source into `count` parts."""
+    cuts = []
+    for i in range(1, count):
+        if not keyframes:
+            break
+        kf = min(keyframes, key=lambda t: abs(t - total_time * i / count))
+        if kf > 0 and (not cuts or kf > cuts[-1]):
+            cuts.append(kf)
+    return cuts
+
+async def progress_blocks(stream):
+    """Yield an FFProgress for every `-progress` key=value block read from an ffmpeg stdout."""
+    block = {}
+    async for line in stream:
+        key, _, value = line.decode(errors="ignore").strip().partition("=")
+        block[key] = value.strip()
+        if key == "progress":
+            yield FFProgress.from_block(block)
+            block = {}
+
 class FFEncoder:
-    def __init__(self, message, path, name, qual):
+    def __init__(self, message, path, name, qual, job_id=None, ffcode=None):
         self.__proc = None
+        self.__procs = []
         self.is_cancelled = False
         self.message = message
         self.__name = name or "unknown"  # Fallback if name is None
         self.__qual = qual
+        self.__ffcode = ffcode
         self.dl_path = path
         self.__total_time = None
         self.out_path = ospath.join("encode", self.__name) if self.__name else None
-        self.__prog_file = 'prog.txt'
+        self.__job_dir = ospath.join("encode", f"job_{job_id}") if job_id is not None else "encode"
+        self.__prog_file = "pipe:1"
         self.__start_time = time()
+        self.__renditions = {}
+        self.__subscribers = [self.status_update, self.record_metrics]
+        self.__last_update = 0
+        self.__stderr = deque(maxlen=40)
+        self.last_progress = FFProgress()
 
-async def progress(self):
-    self.__total_time = await mediainfo(self.dl_path, get_duration=True)
-    if isinstance(self.__total_time, str) or self.__total_time <= 0:
-        self.__total_time = await mediainfo(self.dl_path, get_duration=True)  # एक बार फिर कोशिश
-        if isinstance(self.__total_time, str) or self.__total_time <= 0:
+    def subscribe(self, callback):
+        self.__subscribers.append(callback)
+
+    async def load_total_time(self):
+        self.__total_time = await prober.duration(self.dl_path)
+        if self.__total_time <= 0:
             LOGS.warning(f"{self.__name} के लिए टोटल टाइम गलत है। 1440s का बैकअप यूज कर रहे हैं।")
-            self.__total_time = 1440.0  # अगर फिर भी गलती, तो 24 मिनट का बैकअप
+            self.__total_time = 1440.0  # अगर गलती, तो 24 मिनट का बैकअप
 
-    while not (self.__proc is None or self.is_cancelled):
-        async with aiopen(self.__prog_file, 'r+') as p:
-            text = await p.read()
+    def eta(self, prog):
+        """Seconds left from ffmpeg's own speed factor, falling back to wall clock rate early on."""
+        left = max(self.__total_time - prog.out_time, 0)
+        if prog.speed > 0:
+            return left / prog.speed
+        return left * (time() - self.__start_time) / max(prog.out_time, 1)
 
-        if text:
-            time_done = floor(int(t[-1]) / 1000000) if (t := findall("out_time_ms=(\d+)", text)) else 1
-            ensize = int(s[-1]) if (s := findall(r"total_size=(\d+)", text)) else 0
+    def percent(self, prog):
+        return min(round((prog.out_time / self.__total_time) * 100, 2), 100) if self.__total_time else 0  # 100% से ज्यादा न हो
 
-            diff = time() - self.__start_time
-            speed = ensize / max(diff, 1)
-            percent = min(round((time_done / self.__total_time) * 100, 2), 100)  # 100% से ज्यादा न हो
-            tsize = ensize / (max(percent, 0.01) / 100)
-            eta = (tsize - ensize) / max(speed, 0.01)
+    async def publish(self, prog):
+        self.last_progress = prog
+        for callback in self.__subscribers:
+            try:
+                await callback(self, prog)
+            except Exception as e:
+                LOGS.error(f"FFEncoder Progress Subscriber Error: {e}")
 
-            bar = floor(percent / 8) * "█" + (12 - floor(percent / 8)) * "▒"
+    async def progress(self):
+        """Read `-progress pipe:1` blocks from ffmpeg's stdout and publish each as an FFProgress to the subscribers."""
+        async for prog in progress_blocks(self.__proc.stdout):
+            await self.publish(prog)
+            if prog.done or self.is_cancelled:
+                break
 
-            progress_str = f"""<blockquote>‣ <b>Anime Name :</b> <b><i>{self.__name}</i></b></blockquote>
+    async def drain_stderr(self, proc=None):
+        async for line in (proc or self.__proc).stderr:
+            self.__stderr.append(line.decode(errors="ignore").rstrip())
+
+    async def record_metrics(self, _, prog):
+        ffmetrics[self.__name] = prog
+        if prog.done:
+            ffmetrics.pop(self.__name, None)
+
+    async def status_update(self, _, prog):
+        if not prog.done and time() - self.__last_update < 8:
+            return
+        self.__last_update = time()
+        diff = time() - self.__start_time
+        percent = self.percent(prog)
+        tsize = prog.total_size / (max(percent, 0.01) / 100)
+        bar = floor(percent / 8) * "█" + (12 - floor(percent / 8)) * "▒"
+
+        if self.__renditions:
+            files_str = "\n".join(f"    ‣ <b>{qual}p :</b> {convertBytes(ospath.getsize(out)) if ospath.exists(out) else 'Starting'}" for qual, out in self.__renditions.items())
+            files_str = f"‣ <b>Rendition(s) Encoding:</b>\n{files_str}"
+        else:
+            files_str = f"‣ <b>File(s) Encoded:</b> <code>{Var.QUALS.index(self.__qual)} / {len(Var.QUALS)}</code>"
+
+        progress_str = f"""<blockquote>‣ <b>Anime Name :</b> <b><i>{self.__name}</i></b></blockquote>
 <blockquote>‣ <b>Status :</b> <i>Encoding</i>
-    <code>[{bar}]</code> {percent}%</blockquote> 
-<blockquote>   ‣ <b>Size :</b> {convertBytes(ensize)} out of ~ {convertBytes(tsize)}
-    ‣ <b>Speed :</b> {convertBytes(speed)}/s
+    <code>[{bar}]</code> {percent}%</blockquote>
+<blockquote>   ‣ <b>Size :</b> {convertBytes(prog.total_size)} out of ~ {convertBytes(tsize)}
+    ‣ <b>Speed :</b> {prog.fps:.1f} fps ({prog.speed:.2f}x)
     ‣ <b>Time Took :</b> {convertTime(diff)}
-    ‣ <b>Time Left :</b> {convertTime(eta)}</blockquote>
-<blockquote>‣ <b>File(s) Encoded:</b> <code>{Var.QUALS.index(self.__qual)} / {len(Var.QUALS)}</code></blockquote>"""
+    ‣ <b>Time Left :</b> {convertTime(self.eta(prog))}</blockquote>
+<blockquote>{files_str}</blockquote>"""
 
-            await editMessage(self.message, progress_str)
-            LOGS.info(f"प्रोग्रेस - टोटल टाइम: {self.__total_time}, टाइम डन: {time_done}, प्रतिशत: {percent}")  # डिबगिंग लॉग
+        await editMessage(self.message, progress_str)
+        LOGS.info(f"प्रोग्रेस - टोटल टाइम: {self.__total_time}, टाइम डन: {prog.out_time}, प्रतिशत: {percent}")  # डिबगिंग लॉग
 
-            if (prog := findall(r"progress=(\w+)", text)) and prog[-1] == 'end':
-                break
-
-        await asleep(8)
+    async def link_source(self):
+        """Expose the source inside the job dir under a shell-safe name without moving it, so other jobs can keep reading it."""
+        dl_npath = ospath.join(self.__job_dir, "ffanimeadvin.mkv")
+        await aiomakedirs(self.__job_dir, exist_ok=True)
+        if ospath.lexists(dl_npath):
+            remove(dl_npath)
+        symlink(ospath.abspath(self.dl_path), dl_npath)
+        return dl_npath
 
-    async def start_encode(self):
+    async def feed_stdin(self, stream):
+        """Pipe a TorStream into ffmpeg's stdin, waiting on the download whenever the encoder catches up with it."""
         try:
-            if not self.out_path:
-                await rep.report("[FFEncoder] Output path is None. Skipping encode.", "error")
-                return ""
+            async for chunk in stream.chunks():
+                if self.is_cancelled:
+                    break
+                self.__proc.stdin.write(chunk)
+                await self.__proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.__proc.stdin.close()
+
+    async def __run(self, ffcode, out_paths, stream=None):
+        await aiomakedirs(self.__job_dir, exist_ok=True)
+        await self.load_total_time()
 
-            if ospath.exists(self.__prog_file):
-                await aioremove(self.__prog_file)
+        ffcode = with_threads(ffcode, out_paths)
+        LOGS.info(f'FFCode: {ffcode}')
+        self.__proc = await create_subprocess_shell(ffcode, stdin=PIPE if stream else None, stdout=PIPE, stderr=PIPE)
+        self.__procs = [self.__proc]
+        proc_pid = self.__proc.pid
+        ffpids_cache.append(proc_pid)
+
+        tasks = [create_task(self.progress()), create_task(self.drain_stderr()), *([create_task(self.feed_stdin(stream))] if stream else [])]
+        try:
+            return_code, *_ = await gather(self.__proc.wait(), *tasks)
+        finally:
+            # A stalled stream raises out of feed_stdin, so don't leave ffmpeg or its readers behind
+            if self.__proc.returncode is None:
+                try:
+                    self.__proc.kill()
+                except ProcessLookupError:
+                    pass
+                await self.__proc.wait()
+            for task in tasks:
+                task.cancel()
+            ffpids_cache.remove(proc_pid)
+            ffmetrics.pop(self.__name, None)
+        if return_code != 0 and not self.is_cancelled:
+            await rep.report("\n".join(self.__stderr), "error")
+        return return_code
 
-            async with aiopen(self.__prog_file, 'w+'):
-                LOGS.info("Progress Temp Generated!")
+    async def __run_segments(self, ffcodes, out_paths):
+        """Run the segment encodes side by side, publishing their summed progress as one record."""
+        seg_progress = [FFProgress() for _ in ffcodes]
 
-            dl_npath = ospath.join("encode", "ffanimeadvin.mkv")
-            out_npath = ospath.join("encode", "ffanimeadvout.mkv")
-            await aiorename(self.dl_path, dl_npath)
+        async def watch(i, proc):
+            async for prog in progress_blocks(proc.stdout):
+                seg_progress[i] = prog
+                await self.publish(FFProgress(
+                    out_time=sum(p.out_time for p in seg_progress),
+                    fps=sum(p.fps for p in seg_progress),
+                    speed=sum(p.speed for p in seg_progress),
+                    total_size=sum(p.total_size for p in seg_progress),
+                    bitrate=sum(p.bitrate for p in seg_progress) / len(seg_progress),
+                    frame=sum(p.frame for p in seg_progress),
+                    done=all(p.done for p in seg_progress),
+                ))
+            return await proc.wait()
 
-            ffcode = ffargs[self.__qual].format(dl_npath, self.__prog_file, out_npath)
+        self.__procs = []
+        for ffcode, out_path in zip(ffcodes, out_paths):
+            ffcode = with_threads(ffcode, [out_path], share=len(ffcodes))
             LOGS.info(f'FFCode: {ffcode}')
+            self.__procs.append(await create_subprocess_shell(ffcode, stdout=PIPE, stderr=PIPE))
+            ffpids_cache.append(self.__procs[-1].pid)
 
-            self.__proc = await create_subprocess_shell(ffcode, stdout=PIPE, stderr=PIPE)
-            proc_pid = self.__proc.pid
-            ffpids_cache.append(proc_pid)
+        results = await gather(*(watch(i, proc) for i, proc in enumerate(self.__procs)), *(self.drain_stderr(proc) for proc in self.__procs))
+        for proc in self.__procs:
+            ffpids_cache.remove(proc.pid)
+        ffmetrics.pop(self.__name, None)
+        return_code = next((code for code in results[:len(self.__procs)] if code != 0), 0)
+        if return_code != 0 and not self.is_cancelled:
+            await rep.report("\n".join(self.__stderr), "error")
+        return return_code
 
-            _, return_code = await gather(
-                create_task(self.progress()),
-                self.__proc.wait()
-            )
-            ffpids_cache.remove(proc_pid)
+    async def __run_quiet(self, *args):
+        proc = await create_subprocess_exec(*args, stdout=PIPE, stderr=PIPE)
+        self.__procs = [proc]
+        _, stderr = await proc.communicate()
+        if proc.returncode != 0 and not self.is_cancelled:
+            await rep.report(stderr.decode(errors="ignore")[-3000:], "error")
+        return proc.returncode
+
+    async def start_segment_encode(self):
+        """Split the source at keyframes into SEGMENT_ENCODE parts, encode them as parallel processes and stream copy the parts back together with the original audio, subtitle and attachment streams."""
+        dl_npath = await self.link_source()
+        out_npath = ospath.join(self.__job_dir, "ffanimeadvout.mkv")
+        await self.load_total_time()
+        cuts = segment_times(await prober.keyframes(dl_npath), self.__total_time, Var.SEGMENT_ENCODE)
+        seg_pattern = ospath.join(self.__job_dir, "seg_%03d.mkv")
+        split_args = ["-f", "segment", "-segment_times", ",".join(f"{max(cut - 0.001, 0):.3f}" for cut in cuts), "-reset_timestamps", "1", seg_pattern] if cuts else [seg_pattern % 0]
+        if await self.__run_quiet("ffmpeg", "-y", "-i", dl_npath, "-map", "0:v:0", "-c", "copy", *split_args) != 0:
+            return ""
+
+        segs = [ospath.join(self.__job_dir, f"seg_{i:03d}.mkv") for i in range(len(cuts) + 1)]
+        encs = [ospath.join(self.__job_dir, f"enc_{i:03d}.mkv") for i in range(len(segs))]
+        ffcodes = [f"ffmpeg -i '{seg}' -progress '{self.__prog_file}' -map 0:v:0 -vf scale=-2:{ffheights[self.__qual]} {Var.FF_VOPTS} '{enc}' -y" for seg, enc in zip(segs, encs)]
+        if self.is_cancelled or await self.__run_segments(ffcodes, encs) != 0 or self.is_cancelled:
+            return ""
+
+        concat_list = ospath.join(self.__job_dir, "concat.txt")
+        async with aiopen(concat_list, "w") as f:
+            await f.write("".join(f"file '{ospath.basename(enc)}'\n" for enc in encs))
+        if await self.__run_quiet("ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", concat_list, "-i", dl_npath,
+                                  "-map", "0:v", "-map", "1:a?", "-map", "1:s?", "-map", "1:t?", "-c", "copy", *Var.FF_AOPTS.split(), out_npath) != 0:
+            return ""
+        await aiorename(out_npath, self.out_path)
+        return self.out_path
 
-            await aiorename(dl_npath, self.dl_path)
+    async def start_copy_encode(self):
+        """Remux the source as is, re-encoding only the audio with FF_AOPTS."""
+        dl_npath = await self.link_source()
+        out_npath = ospath.join(self.__job_dir, "ffanimeadvout.mkv")
+        return_code = await self.__run(f"ffmpeg -i '{dl_npath}' -progress '{self.__prog_file}' -map 0 -c copy {Var.FF_AOPTS} '{out_npath}' -y", [out_npath])
+        if self.is_cancelled or return_code != 0 or not ospath.exists(out_npath):
+            return ""
+        await aiorename(out_npath, self.out_path)
+        return self.out_path
+
+    async def start_stream_encode(self, stream):
+        """Encode from a still downloading TorStream through ffmpeg's stdin instead of waiting for the whole file."""
+        out_npath = ospath.join(self.__job_dir, "ffanimeadvout.mkv")
+        return_code = await self.__run((self.__ffcode or ffargs[self.__qual]).format("pipe:0", self.__prog_file, out_npath), [out_npath], stream)
+        if self.is_cancelled or return_code != 0 or not ospath.exists(out_npath):
+            return ""
+        await aiorename(out_npath, self.out_path)
+        return self.out_path
+
+    async def start_encode(self):
+        try:
+            if not self.out_path:
+                await rep.report("[FFEncoder] Output path is None. Skipping encode.", "error")
+                return ""
+            if copy_ok(await prober.probe(self.dl_path), self.__qual, self.__ffcode or ffargs.get(self.__qual, "")):
+                LOGS.info(f"{self.__name} Already Matches {self.__qual}p, Stream Copying")
+                return await self.start_copy_encode()
+            if Var.SEGMENT_ENCODE > 1 and self.__qual in ffheights:
+                return await self.start_segment_encode()
+
+            dl_npath = await self.link_source()
+            out_npath = ospath.join(self.__job_dir, "ffanimeadvout.mkv")
+
+            return_code = await self.__run((self.__ffcode or ffargs[self.__qual]).format(dl_npath, self.__prog_file, out_npath), [out_npath])
 
             if self.is_cancelled:
                 return ""
@@ -114,18 +375,43 @@ async def progress(self):
                 else:
                     LOGS.error("❌ Output path not found after encoding.")
                     return ""
-            else:
-                stderr_log = (await self.__proc.stderr.read()).decode().strip()
-                await rep.report(stderr_log, "error")
-                return ""
+            return ""
         except Exception as e:
             LOGS.error(f"🔥 FFEncoder start_encode Exception: {e}")
             return ""
 
+    async def start_multi_encode(self, renditions):
+        """Encode every {qual: filename} rendition from one decode of the source. Returns {qual: out_path} of the finished ones."""
+        try:
+            dl_npath = await self.link_source()
+            self.__renditions = {qual: ospath.join(self.__job_dir, f"ffanimeadvout_{qual}.mkv") for qual in renditions}
+
+            return_code = await self.__run(multi_ffcode(dl_npath, self.__prog_file, list(self.__renditions.items())), list(self.__renditions.values()))
+
+            if self.is_cancelled or return_code != 0:
+                return {}
+
+            out_paths = {}
+            for qual, out_npath in self.__renditions.items():
+                if ospath.exists(out_npath):
+                    out_paths[qual] = ospath.join("encode", renditions[qual])
+                    await aiorename(out_npath, out_paths[qual])
+                else:
+                    LOGS.error(f"❌ {qual}p Output path not found after encoding.")
+            return out_paths
+        except Exception as e:
+            LOGS.error(f"🔥 FFEncoder start_multi_encode Exception: {e}")
+            return {}
+
+    @staticmethod
+    async def clean_job(job_id):
+        if ospath.isdir(job_dir := ospath.join("encode", f"job_{job_id}")):
+            await aiormtree(job_dir, ignore_errors=True)
+
     async def cancel_encode(self):
         self.is_cancelled = True
-        if self.__proc is not None:
+        for proc in self.__procs:
             try:
-                self.__proc.kill()
+                proc.kill()
             except:
                 pass
@@ -0,0 +1,91 @@
+from math import log10
+from time import time
+from heapq import heappush, heappop
+from itertools import count
+from contextlib import asynccontextmanager
+from asyncio import Event
+
+from bot import Var
+
+
+def encode_priority(adata, ep_no, duration=0, force=False):
+    """Popular shows and the newest aired episode first, long encodes last, weighted by PRIO_POPULARITY, PRIO_FRESH and PRIO_COST."""
+    popularity = log10((adata or {}).get('popularity') or 1)
+    latest = ((adata or {}).get('nextAiringEpisode') or {}).get('episode', 0) - 1
+    try:
+        fresh = 1.0 if not force and (latest <= 0 or int(ep_no) >= latest) else 0.0
+    except (TypeError, ValueError):
+        fresh = 0.0
+    return round(Var.PRIO_POPULARITY * popularity + Var.PRIO_FRESH * fresh - Var.PRIO_COST * duration / 3600, 3)
+
+
+class FFScheduler:
+    """Hands out the ENCODE_SLOTS encode slots to the highest priority waiter the moment a job is queued or a slot frees up."""
+    def __init__(self, slots=1):
+        self.__slots = slots
+        self.__heap = []
+        self.__seq = count()
+        self.__waiting = {}
+        self.__running = {}
+        self.__idle = Event()
+        self.__idle.set()
+
+    def __dispatch(self):
+        while len(self.__running) < self.__slots and self.__heap:
+            _, seq, key = heappop(self.__heap)
+            if (entry := self.__waiting.get(key)) is None or entry['seq'] != seq:
+                continue
+            del self.__waiting[key]
+            entry['started'] = time()
+            self.__running[key] = entry
+            entry['event'].set()
+        if not self.__waiting and not self.__running:
+            self.__idle.set()
+
+    async def acquire(self, key, name, priority=0.0):
+        entry = {'key': key, 'name': name, 'priority': priority, 'seq': next(self.__seq), 'queued': time(), 'event': Event()}
+        self.__waiting[key] = entry
+        heappush(self.__heap, (-priority, entry['seq'], key))
+        self.__idle.clear()
+        self.__dispatch()
+        try:
+            await entry['event'].wait()
+        except BaseException:
+            self.release(key)
+            raise
+
+    def release(self, key):
+        self.__waiting.pop(key, None)
+        self.__running.pop(key, None)
+        self.__dispatch()
+
+    @asynccontextmanager
+    async def slot(self, key, name, priority=0.0):
+        await self.acquire(key, name, priority)
+        try:
+            yield
+        finally:
+            self.release(key)
+
+    def set_priority(self, key, priority):
+        if (entry := self.__waiting.get(key)) is None:
+            return False
+        entry.update(priority=priority, seq=next(self.__seq))
+        heappush(self.__heap, (-priority, entry['seq'], key))
+        return True
+
+    def locked(self):
+        return len(self.__running) >= self.__slots
+
+    def empty(self):
+        return not self.__waiting and not self.__running
+
+    async def join(self):
+        await self.__idle.wait()
+
+    def jobs(self):
+        """Running jobs followed by the waiting ones in the order they will be started."""
+        waiting = sorted(self.__waiting.values(), key=lambda entry: (-entry['priority'], entry['seq']))
+        return [('running', entry) for entry in self.__running.values()] + [('queued', entry) for entry in waiting]
+
+ffsched = FFScheduler(Var.ENCODE_SLOTS)
@@ -1,18 +1,17 @@
 from multiprocessing import cpu_count
 from concurrent.futures import ThreadPoolExecutor
 from functools import partial, wraps
-from json import loads as jloads
 from re import findall
 from math import floor
-from os import path as ospath
+from os import path as ospath, listdir
 from time import time, sleep
 from traceback import format_exc
 from asyncio import sleep as asleep, create_subprocess_shell
 from asyncio.subprocess import PIPE
 from base64 import urlsafe_b64encode, urlsafe_b64decode
 
-from aiohttp import ClientSession
 from aiofiles import open as aiopen
+from aiofiles.os import remove as aioremove
 from aioshutil import rmtree as aiormtree
 from html_telegraph_poster import TelegraphPoster
 from feedparser import parse as feedparse
@@ -22,6 +21,8 @@ from pyrogram.errors import MessageNotModified, FloodWait, UserNotParticipant, R
 
 from bot import bot, bot_loop, LOGS, Var
 from .reporter import rep
+from .http_client import http
+from .probe import prober
 
 
 def handle_logs(func):
@@ -56,9 +57,9 @@ async def getfeed(link, index=0):
 
 @handle_logs
 async def aio_urldownload(link):
-    async with ClientSession() as sess:
-        async with sess.get(link) as data:
-            image = await data.read()
+    status, image, _ = await http.request('media', 'GET', link, resp_type="bytes", timeout=60)
+    if status != 200 or not image:
+        raise ValueError(f"Download Failed for {link} [{status}]")
     path = f"thumbs/{link.split('/')[-1]}"
     if not path.endswith((".jpg" or ".png")):
         path += ".jpg"
@@ -163,26 +164,32 @@ async def get_fsubs(uid, txtargs):
 
 async def mediainfo(file, get_json=False, get_duration=False):
     try:
-        outformat = "HTML"
-        if get_duration or get_json:
-            outformat = "JSON"
+        if get_duration:
+            return await prober.duration(file) or 1440 # 24min
+        outformat = "JSON" if get_json else "HTML"
         process = await create_subprocess_shell(f"mediainfo '''{file}''' --Output={outformat}", stdout=PIPE, stderr=PIPE)
         stdout, _ = await process.communicate()
-        if get_duration:
-            try:
-                return float(jloads(stdout.decode())['media']['track'][0]['Duration'])
-            except Exception:
-                return 1440 # 24min
         return await get_telegraph(stdout.decode())
     except Exception as err:
         await rep.report(format_exc(), "error")
         return ""
 
-async def clean_up():
-    try:
-        (await aiormtree(dirtree) for dirtree in ("downloads", "thumbs", "encode"))
-    except Exception as e:
-        LOGS.error(str(e))
+async def clean_up(keep=()):
+    """Empty the scratch dirs, sparing the paths in keep (sources and renditions the job journal will resume from)."""
+    for dirtree in ("downloads", "thumbs", "encode"):
+        if not ospath.isdir(dirtree):
+            continue
+        for entry in listdir(dirtree):
+            path = ospath.abspath(ospath.join(dirtree, entry))
+            if path in keep or any(kept.startswith(path + ospath.sep) for kept in keep):
+                continue
+            try:
+                if ospath.isdir(path) and not ospath.islink(path):
+                    await aiormtree(path)
+                else:
+                    await aioremove(path)
+            except Exception as e:
+                LOGS.error(str(e))
 
 def convertTime(s: int) -> str:
     m, s = divmod(int(s), 60)
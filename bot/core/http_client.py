@@ -0,0 +1,104 @@
+from time import monotonic
+from random import uniform
+from asyncio import Lock, sleep as asleep, TimeoutError as AsyncTimeoutError
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, ClientError
+
+from bot import Var, LOGS
+
+
+class TokenBucket:
+    def __init__(self, rate, per):
+        self.__rate = rate / per
+        self.__capacity = rate
+        self.__tokens = float(rate)
+        self.__updated = monotonic()
+        self.__lock = Lock()
+
+    async def acquire(self):
+        async with self.__lock:
+            while True:
+                now = monotonic()
+                self.__tokens = min(self.__capacity, self.__tokens + (now - self.__updated) * self.__rate)
+                self.__updated = now
+                if self.__tokens >= 1:
+                    self.__tokens -= 1
+                    return
+                await asleep((1 - self.__tokens) / self.__rate)
+
+
+class HTTPClient:
+    # provider: [(requests, per seconds), ...]
+    LIMITS = {
+        'anilist': [(Var.ANILIST_RPM, 60)],
+        'jikan': [(3, 1), (60, 60)],
+        'kitsu': [(60, 60)],
+        'ann': [(1, 1)],
+    }
+
+    def __init__(self, retries=3):
+        self.__session = None
+        self.__retries = retries
+        self.__buckets = {provider: [TokenBucket(*lim) for lim in limits] for provider, limits in self.LIMITS.items()}
+        self.__stats = {}
+
+    async def session(self):
+        if self.__session is None or self.__session.closed:
+            self.__session = ClientSession(connector=TCPConnector(limit=100, limit_per_host=10, ttl_dns_cache=300, keepalive_timeout=60))
+        return self.__session
+
+    def __record(self, provider, elapsed, failed=False):
+        stat = self.__stats.setdefault(provider, {'count': 0, 'errors': 0, 'total': 0.0, 'max': 0.0})
+        stat['count'] += 1
+        stat['errors'] += int(failed)
+        stat['total'] += elapsed
+        stat['max'] = max(stat['max'], elapsed)
+
+    async def request(self, provider, method, url, resp_type="json", timeout=15, retries=None, **kwargs):
+        """Rate limited request returning (status, body, headers). 429/5xx and network errors are retried with jittered backoff, status is 0 if the host was never reached."""
+        status, headers = 0, {}
+        retries = self.__retries if retries is None else retries
+        for attempt in range(retries + 1):
+            for bucket in self.__buckets.get(provider, []):
+                await bucket.acquire()
+            start, retry_after = monotonic(), None
+            try:
+                async with (await self.session()).request(method, url, timeout=ClientTimeout(total=timeout), **kwargs) as resp:
+                    status, headers = resp.status, resp.headers
+                    if status == 429 or status >= 500:
+                        retry_after = resp.headers.get('Retry-After')
+                    else:
+                        if resp_type == "json":
+                            body = await resp.json(content_type=None)
+                        elif resp_type == "text":
+                            body = await resp.text()
+                        else:
+                            body = await resp.read()
+                        self.__record(provider, monotonic() - start)
+                        return status, body, headers
+            except ValueError as e:
+                self.__record(provider, monotonic() - start, failed=True)
+                LOGS.warning(f"[HTTP] {provider} Decode Error: {e}")
+                return status, None, headers
+            except (ClientError, AsyncTimeoutError) as e:
+                status, headers = 0, {}
+                LOGS.warning(f"[HTTP] {provider} Request Error: {e!r}")
+            self.__record(provider, monotonic() - start, failed=True)
+            if attempt == retries:
+                break
+            delay = min(float(retry_after), 120) if retry_after and retry_after.isdigit() else min(2 ** attempt, 30)
+            LOGS.warning(f"[HTTP] {provider} Status {status}, Retrying in {delay:.1f}s ({attempt + 1}/{retries})")
+            await asleep(delay + uniform(0, 1))
+        return status, None, headers
+
+    def stats(self):
+        txt = "<b>HTTP Provider Latency</b>\n\n"
+        for provider, stat in sorted(self.__stats.items()):
+            avg = stat['total'] / max(stat['count'], 1)
+            txt += f"• <b>{provider}</b> : {stat['count']} req, {stat['errors']} err, avg {avg:.2f}s, max {stat['max']:.2f}s\n"
+        return txt
+
+    async def close(self):
+        if self.__session is not None and not self.__session.closed:
+            await self.__session.close()
+
+http = HTTPClient()
@@ -0,0 +1,139 @@
+from json import dump as jdump, load as jload
+from time import time
+from uuid import uuid4
+from fcntl import flock, LOCK_EX, LOCK_UN
+from os import path as ospath, makedirs, listdir, replace
+from asyncio import sleep as asleep
+
+from bot import Var, LOGS
+from .database import db
+from .func_utils import sync_to_async, editMessage, convertTime
+
+
+class MongoJobStore:
+    async def put(self, job):
+        await db.putJob(job)
+
+    async def get(self, job_id):
+        return await db.getJob(job_id)
+
+    async def claim(self, worker, lease):
+        return await db.claimJob(worker, lease, time(), Var.JOB_RETRIES)
+
+    async def update(self, job_id, fields, worker=None):
+        return await db.updateJob(job_id, fields, worker)
+
+
+class FileJobStore:
+    """Same protocol as MongoJobStore on a local directory, one JSON file per job guarded by an flock."""
+    def __init__(self, path):
+        self.__path = path
+        makedirs(path, exist_ok=True)
+
+    def __file(self, job_id):
+        return ospath.join(self.__path, f"{job_id}.json")
+
+    def __read(self, job_id):
+        try:
+            with open(self.__file(job_id)) as f:
+                return jload(f)
+        except (OSError, ValueError):
+            return {}
+
+    def __write(self, job):
+        tmp = self.__file(job['_id']) + ".tmp"
+        with open(tmp, "w") as f:
+            jdump(job, f)
+        replace(tmp, self.__file(job['_id']))
+
+    def __locked(self, func, *args):
+        with open(ospath.join(self.__path, ".lock"), "w") as lock:
+            flock(lock, LOCK_EX)
+            try:
+                return func(*args)
+            finally:
+                flock(lock, LOCK_UN)
+
+    def __claim(self, worker, lease):
+        now, jobs = time(), []
+        for fname in listdir(self.__path):
+            if fname.endswith(".json") and (job := self.__read(fname[:-5])):
+                jobs.append(job)
+        for job in sorted(jobs, key=lambda j: j.get('created', 0)):
+            if job['attempts'] < Var.JOB_RETRIES and (job['status'] == 'queued' or (job['status'] == 'leased' and job['lease_until'] < now)):
+                job.update(status='leased', worker=worker, lease_until=now + lease, attempts=job['attempts'] + 1)
+                self.__write(job)
+                return job
+
+    def __update(self, job_id, fields, worker):
+        if not (job := self.__read(job_id)) or (worker and job.get('worker') != worker):
+            return False
+        job.update(fields)
+        self.__write(job)
+        return True
+
+    async def put(self, job):
+        await sync_to_async(self.__locked, self.__write, job)
+
+    async def get(self, job_id):
+        return await sync_to_async(self.__read, job_id)
+
+    async def claim(self, worker, lease):
+        return await sync_to_async(self.__locked, self.__claim, worker, lease)
+
+    async def update(self, job_id, fields, worker=None):
+        return await sync_to_async(self.__locked, self.__update, job_id, fields, worker)
+
+
+class JobQueue:
+    """Encode jobs handed to `python -m bot.worker` processes. Jobs carry the source as the bot's local path and
+    workers leave the output in JOB_OUT_DIR, so workers on other machines need downloads/ and JOB_OUT_DIR on a
+    filesystem shared with the bot (same paths on both sides). A worker also accepts an http(s) source URL."""
+    def __init__(self, store):
+        self.store = store
+
+    async def submit(self, src, qual, name, ffcode):
+        job_id = uuid4().hex
+        await self.store.put({
+            '_id': job_id, 'src': src, 'qual': qual, 'name': name, 'ffcode': ffcode,
+            'status': 'queued', 'attempts': 0, 'worker': None, 'lease_until': 0,
+            'progress': 0, 'result': None, 'error': None, 'created': time()
+        })
+        return job_id
+
+    async def wait(self, job_ids, message=None, title="", interval=5):
+        """Wait for workers to finish the jobs, mirroring their progress into message. Returns {job_id: output path or ''}."""
+        start, results = time(), {}
+        while len(results) < len(job_ids):
+            states = []
+            for job_id in job_ids:
+                if job_id in results:
+                    continue
+                if not (job := await self.store.get(job_id)):
+                    results[job_id] = ""
+                elif job['status'] == 'done':
+                    results[job_id] = (job.get('result') or {}).get('out_path', "")
+                elif job['status'] == 'failed' or (job['status'] == 'leased' and job['attempts'] >= Var.JOB_RETRIES and job['lease_until'] < time()):
+                    LOGS.error(f"Encode Job {job_id} Failed : {job.get('error')}")
+                    results[job_id] = ""
+                else:
+                    states.append(f"‣ <b>{job['qual']}p :</b> <i>" + (f"Encoding on <code>{job['worker']}</code> : {job.get('progress', 0)}%" if job['status'] == 'leased' else "Waiting for an Encode Worker...") + "</i>")
+            if len(results) < len(job_ids):
+                await editMessage(message, f"‣ <b>Anime Name :</b> <b><i>{title}</i></b>\n\n" + "\n".join(states) + f"\n‣ <b>Time Took :</b> {convertTime(time() - start) or '0s'}")
+                await asleep(interval)
+        return results
+
+    async def encode(self, message, src, title, renditions):
+        """Submit every {qual: (name, ffcode)} rendition at once so idle workers pick them up in parallel, then wait for all. Returns {qual: output path} of the ones that finished."""
+        job_ids = {qual: await self.submit(src, qual, name, ffcode) for qual, (name, ffcode) in renditions.items()}
+        results = await self.wait(list(job_ids.values()), message, title)
+        return {qual: out_path for qual, job_id in job_ids.items() if (out_path := results[job_id])}
+
+def get_jobqueue():
+    if Var.JOB_QUEUE == "mongo":
+        return JobQueue(MongoJobStore())
+    if Var.JOB_QUEUE.startswith("file:"):
+        return JobQueue(FileJobStore(Var.JOB_QUEUE[5:]))
+    return None
+
+jobqueue = get_jobqueue()
@@ -0,0 +1,66 @@
+from time import time
+from os import path as ospath
+
+from bot import Var
+from .database import db
+
+
+class JobJournal:
+    """Per-episode record of how far get_animes() got (detected → downloaded → encoding, plus each rendition's encoded/uploaded state), kept in Mongo so a restart can pick the episode up where it stopped."""
+    def __init__(self):
+        self.__jobs = {}
+
+    async def start(self, key, name, torrent, force=False, ani_id=None, ep_no=None):
+        if not (job := await db.getJournal(key)) or job.get('stage') == 'done':
+            job = {'name': name, 'torrent': torrent, 'force': force, 'ani_id': ani_id, 'ep_no': ep_no, 'stage': 'detected', 'dl': None, 'post_id': None, 'quals': {}, 'created': time()}
+            await db.saveJournal(key, job)
+        await db.saveJournal(key, {'updated': time()}, inc={'attempts': 1})
+        job['attempts'] = job.get('attempts', 0) + 1
+        self.__jobs[key] = job
+        return job
+
+    async def update(self, key, **fields):
+        fields['updated'] = time()
+        self.__jobs.get(key, {}).update(fields)
+        await db.saveJournal(key, fields)
+
+    async def rendition(self, key, qual, state, path=None):
+        if (job := self.__jobs.get(key)) is not None:
+            job.setdefault('quals', {})[qual] = {'state': state, 'path': path}
+        await db.saveJournal(key, {f"quals.{qual}": {'state': state, 'path': path}, 'updated': time()})
+
+    def get(self, key):
+        return self.__jobs.get(key, {})
+
+    def source(self, key):
+        """The downloaded source of key if it is still on disk."""
+        dl = self.get(key).get('dl')
+        return dl if dl and ospath.exists(dl) else None
+
+    def encoded(self, key, qual):
+        """A finished but not yet uploaded rendition of key if it is still on disk."""
+        rend = self.get(key).get('quals', {}).get(qual) or {}
+        return rend['path'] if rend.get('state') == 'encoded' and rend.get('path') and ospath.exists(rend['path']) else None
+
+    async def finish(self, key):
+        self.__jobs.pop(key, None)
+        await db.delJournal(key)
+
+    async def release(self, key):
+        """Forget an in-memory job that stopped early, leaving its journal entry for the next resume."""
+        self.__jobs.pop(key, None)
+
+    async def unfinished(self, exhausted=False):
+        """Jobs still to be resumed, plus those out of retries when exhausted is set."""
+        return [job for job in await db.getJournals() if exhausted or job.get('attempts', 0) < Var.JOB_RETRIES]
+
+    async def keep_paths(self):
+        """Sources and renditions that unfinished jobs will reuse, to be spared by clean_up()."""
+        paths = set()
+        for job in await self.unfinished():
+            if job.get('dl'):
+                paths.add(ospath.abspath(job['dl']))
+            paths.update(ospath.abspath(rend['path']) for rend in job.get('quals', {}).values() if rend.get('state') == 'encoded' and rend.get('path'))
+        return paths
+
+journal = JobJournal()
@@ -0,0 +1,56 @@
+from time import time
+from os import path as ospath
+from asyncio import create_subprocess_exec
+from asyncio.subprocess import DEVNULL
+from pyrogram.errors import BadRequest
+
+from bot import bot, LOGS, Var
+from .database import db
+
+
+class MediaCache:
+    def __init__(self):
+        self.__ids = {}
+
+    async def get(self, key):
+        if not (item := self.__ids.get(key)):
+            mediaset = await db.getMedia(key)
+            item = self.__ids[key] = (mediaset.get('file_id'), mediaset.get('expires', 0))
+        return item[0] if item[0] and item[1] > time() else None
+
+    async def set(self, key, file_id):
+        expires = time() + Var.MEDIA_TTL
+        self.__ids[key] = (file_id, expires)
+        await db.saveMedia(key, file_id, expires)
+
+    async def drop(self, key):
+        self.__ids.pop(key, None)
+        await db.delMedia(key)
+
+    async def send_poster(self, chat_id, aniInfo, caption):
+        """Send the anime poster, reusing the Telegram file_id of an earlier post of the same AniList id."""
+        key = f"poster:{ani_id}" if (ani_id := await aniInfo.get_id()) else None
+        if key and (file_id := await self.get(key)):
+            try:
+                return await bot.send_photo(chat_id, photo=file_id, caption=caption)
+            except BadRequest as e:
+                LOGS.warning(f"Cached Poster {key} Rejected, Refreshing : {e}")
+                await self.drop(key)
+        msg = await bot.send_photo(chat_id, photo=await aniInfo.get_poster(), caption=caption)
+        if key and msg and msg.photo:
+            await self.set(key, msg.photo.file_id)
+        return msg
+
+    async def get_thumb(self, src="thumb.jpg", dest="thumb.tg.jpg"):
+        """Telegram only accepts freshly uploaded thumbs, so keep a pre-scaled copy under 320px to make every re-send a few KB."""
+        if not ospath.exists(src):
+            return None
+        if ospath.exists(dest) and ospath.getmtime(dest) >= ospath.getmtime(src):
+            return dest
+        proc = await create_subprocess_exec("ffmpeg", "-y", "-i", src, "-vf", "scale='min(320,iw)':'min(320,ih)':force_original_aspect_ratio=decrease", "-q:v", "5", dest, stdout=DEVNULL, stderr=DEVNULL)
+        if await proc.wait() == 0 and ospath.exists(dest):
+            return dest
+        LOGS.warning("Thumbnail Downscale Failed, Using Original thumb.jpg")
+        return src
+
+mediacache = MediaCache()
@@ -0,0 +1,110 @@
+from re import search
+from time import time
+from hashlib import sha1
+from os import path as ospath, link, makedirs, remove
+from pyrogram.errors import FloodWait
+
+from bot import bot, LOGS, Var
+from .database import db
+from .ffencoder import encode_profile
+
+
+class EncodeCache:
+    """Finished renditions keyed by source identity plus the encode profile, holding a hardlink of the output and the FILE_STORE message it was uploaded as."""
+    def __init__(self, path="cache", limit=0):
+        self.__path = path
+        self.__limit = limit
+
+    @staticmethod
+    def source_key(torrent):
+        if (mag := search(r"btih:([0-9a-zA-Z]+)", torrent or "")):
+            return mag.group(1).lower()
+        return "url:" + sha1((torrent or "").encode()).hexdigest()
+
+    @staticmethod
+    def key(src_key, qual):
+        return f"{src_key}:{qual}:{sha1(encode_profile(qual).encode()).hexdigest()[:16]}"
+
+    async def get(self, key):
+        return await db.getEncode(key)
+
+    async def get_msg(self, key):
+        """The cached FILE_STORE message of key, re-sent from its file_id if the original was deleted."""
+        if not (encset := await db.getEncode(key)) or not encset.get('msg_id'):
+            return None
+        try:
+            msg = await bot.get_messages(Var.FILE_STORE, message_ids=encset['msg_id'])
+            if msg and not msg.empty and (msg.document or msg.video):
+                await db.saveEncode(key, {'used': time()})
+                return msg
+            if encset.get('file_id'):
+                msg = await bot.send_cached_media(Var.FILE_STORE, encset['file_id'], caption=f"<i>{encset.get('name', '')}</i>")
+                await self.set_msg(key, msg)
+                return msg
+        except FloodWait:
+            raise
+        except Exception as e:
+            LOGS.warning(f"Cached Upload {key} Unusable : {e}")
+        await db.saveEncode(key, {'msg_id': None, 'file_id': None})
+        return None
+
+    async def set_msg(self, key, msg):
+        media = msg.document or msg.video
+        await db.saveEncode(key, {'msg_id': msg.id, 'file_id': media.file_id, 'name': media.file_name, 'used': time()})
+
+    def has_file(self, encset):
+        return bool(encset.get('path')) and ospath.exists(encset['path'])
+
+    async def store(self, key, out_path):
+        """Hardlink a finished output into the cache before the uploader deletes it, then evict the least recently used files over the size limit."""
+        if self.__limit <= 0 or not ospath.exists(out_path):
+            return
+        makedirs(self.__path, exist_ok=True)
+        cache_path = ospath.join(self.__path, sha1(key.encode()).hexdigest() + ospath.splitext(out_path)[1])
+        try:
+            if ospath.exists(cache_path):
+                remove(cache_path)
+            link(out_path, cache_path)
+        except OSError as e:
+            LOGS.warning(f"Encode Cache Link Failed for {out_path} : {e}")
+            return
+        await db.saveEncode(key, {'path': cache_path, 'size': ospath.getsize(cache_path), 'used': time()})
+        await self.evict()
+
+    async def restore(self, key, out_path):
+        """Hardlink a cached output back to out_path, returns out_path or '' on a miss."""
+        if not self.has_file(encset := await db.getEncode(key)):
+            return ""
+        try:
+            if ospath.exists(out_path):
+                remove(out_path)
+            link(encset['path'], out_path)
+        except OSError as e:
+            LOGS.warning(f"Restoring Cached Encode Failed : {e}")
+            return ""
+        await db.saveEncode(key, {'used': time()})
+        return out_path
+
+    async def evict(self, limit=None):
+        """Drop the least recently used cached files until the cache fits in limit bytes (the configured size by default). Returns the bytes freed."""
+        limit = self.__limit if limit is None else limit
+        encsets = await db.getEncodes()
+        total = sum(encset.get('size', 0) for encset in encsets)
+        freed = 0
+        for encset in encsets:
+            if total <= limit:
+                break
+            if ospath.exists(encset['path']):
+                remove(encset['path'])
+            total -= encset.get('size', 0)
+            freed += encset.get('size', 0)
+            await db.saveEncode(encset['_id'], {'path': None, 'size': 0})
+            LOGS.info(f"Evicted {encset.get('name') or encset['_id']} from Encode Cache")
+        return freed
+
+    async def shrink(self, size):
+        """Free at least size bytes from the cache for the storage manager."""
+        total = sum(encset.get('size', 0) for encset in await db.getEncodes())
+        return await self.evict(max(0, total - size))
+
+outcache = EncodeCache(Var.ENCODE_CACHE_DIR, int(Var.ENCODE_CACHE_GB * 1024 ** 3))
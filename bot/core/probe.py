@@ -0,0 +1,99 @@
+from json import loads as jloads
+from os import path as ospath, stat
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from asyncio import create_subprocess_exec, Lock
+from asyncio.subprocess import PIPE
+
+from bot import LOGS
+
+
+@dataclass
+class MediaProbe:
+    duration: float = 0.0
+    bitrate: int = 0
+    width: int = 0
+    height: int = 0
+    vcodec: str = ""
+    acodec: str = ""
+    streams: list = field(default_factory=list)
+    format: dict = field(default_factory=dict)
+    keyframes: list = None
+
+    @classmethod
+    def from_json(cls, data):
+        streams, fmt = data.get('streams', []), data.get('format', {})
+        video = next((s for s in streams if s.get('codec_type') == "video" and not s.get('disposition', {}).get('attached_pic')), {})
+        audio = next((s for s in streams if s.get('codec_type') == "audio"), {})
+        def num(value, cast=float):
+            try:
+                return cast(float(value))
+            except (TypeError, ValueError):
+                return cast(0)
+        return cls(
+            duration=num(fmt.get('duration')) or max((num(s.get('duration')) for s in streams), default=0.0),
+            bitrate=num(fmt.get('bit_rate'), int),
+            width=num(video.get('width'), int),
+            height=num(video.get('height'), int),
+            vcodec=video.get('codec_name', ""),
+            acodec=audio.get('codec_name', ""),
+            streams=streams,
+            format=fmt,
+        )
+
+
+class MediaProber:
+    """One ffprobe pass per file, cached by real path, mtime and size and shared by every caller."""
+    def __init__(self, size=64):
+        self.__cache = OrderedDict()
+        self.__locks = {}
+        self.__size = size
+
+    @staticmethod
+    def __key(path):
+        st = stat(path)
+        return (ospath.realpath(path), st.st_mtime_ns, st.st_size)
+
+    @staticmethod
+    async def __run(*args):
+        proc = await create_subprocess_exec(*args, stdout=PIPE, stderr=PIPE)
+        stdout, stderr = await proc.communicate()
+        if proc.returncode != 0:
+            LOGS.error(f"FFProbe Failed : {stderr.decode(errors='ignore')[-500:]}")
+        return stdout.decode(errors="ignore")
+
+    async def probe(self, path):
+        if not ospath.exists(path):
+            return MediaProbe()
+        key = self.__key(path)
+        async with self.__locks.setdefault(key[0], Lock()):
+            if (info := self.__cache.get(key)) is None:
+                try:
+                    info = MediaProbe.from_json(jloads(await self.__run("ffprobe", "-v", "error", "-print_format", "json", "-show_format", "-show_streams", path) or "{}"))
+                except ValueError:
+                    info = MediaProbe()
+                self.__cache[key] = info
+                while len(self.__cache) > self.__size:
+                    self.__cache.popitem(last=False)
+            self.__cache.move_to_end(key)
+            return info
+
+    async def keyframes(self, path):
+        """Sorted keyframe timestamps of the first video stream, scanned once per file."""
+        info = await self.probe(path)
+        if info.keyframes is None:
+            keyframes = []
+            for line in (await self.__run("ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", path)).splitlines():
+                pts, _, flags = line.partition(",")
+                if "K" in flags:
+                    try:
+                        keyframes.append(float(pts))
+                    except ValueError:
+                        continue
+            info.keyframes = sorted(keyframes)
+        return info.keyframes
+
+    async def duration(self, path):
+        return (await self.probe(path)).duration
+
+prober = MediaProber()
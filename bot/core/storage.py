@@ -0,0 +1,103 @@
+from time import time
+from shutil import disk_usage
+from os import path as ospath, listdir, stat, remove
+from asyncio import Condition, wait_for, TimeoutError as AsyncTimeout
+from aioshutil import rmtree as aiormtree
+
+from bot import Var, LOGS
+from .outcache import outcache
+from .ffencoder import ffheights
+
+
+def path_size(path):
+    if not ospath.exists(path):
+        return 0
+    if not ospath.isdir(path) or ospath.islink(path):
+        return ospath.getsize(path) if not ospath.islink(path) else 0
+    total = 0
+    for entry in listdir(path):
+        total += path_size(ospath.join(path, entry))
+    return total
+
+def rendition_estimate(size, height, quals):
+    """Expected bytes of the quals renditions of a size byte source, scaled by pixel count."""
+    return int(sum(size * min(1.0, (ffheights[qual] / height) ** 2) if qual in ffheights and height else size for qual in quals))
+
+
+class StorageManager:
+    """Admits downloads and encodes only when the disk can hold what they are expected to write, keeping DISK_FREE_GB spare and evicting finished artifacts in LRU order to make room."""
+    def __init__(self, root=".", spare=0):
+        self.__root = root
+        self.__spare = spare
+        self.__reserved = {}
+        self.__waiting = set()
+        self.__cond = Condition()
+
+    def pending(self):
+        """Bytes reserved but not yet written, by every job. A part counts its paths at their largest, so a source removed after encoding stays settled."""
+        total = 0
+        for parts in self.__reserved.values():
+            for part in parts:
+                part['written'] = max(part['written'], sum(path_size(path) for path in part['paths']))
+                total += max(0, part['size'] - part['written'])
+        return total
+
+    def available(self):
+        return disk_usage(self.__root).free - self.pending() - self.__spare
+
+    async def reserve(self, key, size, paths=(), on_wait=None):
+        """Hold size bytes for key until release(key), counting down as its paths fill up, and wait for space when the disk is short."""
+        async with self.__cond:
+            waited = False
+            while self.available() < size:
+                await self.evict(size - self.available())
+                if self.available() >= size:
+                    break
+                if all(other in self.__waiting for other in self.__reserved if other != key):
+                    # No running job left to free its reservation, so waiting would never end
+                    LOGS.warning(f"Admitting {key} Without Enough Disk Space, Nothing Left to Wait For")
+                    break
+                if on_wait and not waited:
+                    await on_wait()
+                waited = True
+                self.__waiting.add(key)
+                try:
+                    await wait_for(self.__cond.wait(), 60)
+                except AsyncTimeout:
+                    pass
+                finally:
+                    self.__waiting.discard(key)
+            self.__reserved.setdefault(key, []).append({'size': size, 'paths': [ospath.abspath(path) for path in paths], 'written': 0})
+
+    async def release(self, key):
+        if self.__reserved.pop(key, None) is not None:
+            async with self.__cond:
+                self.__cond.notify_all()
+
+    async def evict(self, size):
+        """Free at least size bytes from finished artifacts: posters, benchmark clips and stale job dirs oldest first, then the encode cache. Returns the bytes freed."""
+        candidates = []
+        for dirtree in ("thumbs", "bench"):
+            if ospath.isdir(dirtree):
+                candidates += [ospath.join(dirtree, entry) for entry in listdir(dirtree)]
+        if ospath.isdir("encode"):
+            candidates += [ospath.join("encode", entry) for entry in listdir("encode") if entry.startswith(("job_", "addons_")) and time() - stat(ospath.join("encode", entry)).st_mtime > Var.SCRATCH_TTL]
+        freed = 0
+        for path in sorted(candidates, key=lambda path: stat(path).st_atime):
+            if freed >= size:
+                return freed
+            freed += path_size(path)
+            if ospath.isdir(path):
+                await aiormtree(path, ignore_errors=True)
+            else:
+                remove(path)
+            LOGS.info(f"Storage Evicted {path}")
+        if freed < size:
+            freed += await outcache.shrink(size - freed)
+        return freed
+
+    def stats(self):
+        usage = disk_usage(self.__root)
+        return usage.free, usage.total, self.pending(), len(self.__reserved)
+
+storage = StorageManager(spare=int(Var.DISK_FREE_GB * 1024 ** 3))
@@ -1,14 +1,15 @@
 from calendar import month_name
 from datetime import datetime
 from random import choice
-from asyncio import sleep as asleep
-from aiohttp import ClientSession, ClientError, ContentTypeError
+from asyncio import create_task, wait, FIRST_COMPLETED
 from anitopy import parse
 from xml.etree import ElementTree as ET
 
 from bot import Var, bot
+from .anicache import anicache, aliases
 from .ffencoder import ffargs
 from .func_utils import handle_logs
+from .http_client import http
 from .reporter import rep
 
 CAPTION_FORMAT = """
@@ -115,12 +116,51 @@ query ($id: Int, $search: String, $seasonYear: Int) {
 }
 """
 
+ANIME_BATCH_FIELDS = """
+        id
+        title {
+            romaji
+            english
+            native
+        }
+        format
+        status(version: 2)
+        episodes
+        siteUrl
+"""
+
+def normalize_anidata(data, source):
+    """Bring provider payloads to the AniList Media shape used by TextEditor."""
+    if not data:
+        return {}
+    def as_int(val):
+        try:
+            return int(val)
+        except (TypeError, ValueError):
+            return None
+    titles = data.get("title") or {}
+    sd = data.get("startDate") or {}
+    return {
+        **data,
+        "id": data.get("id") if source == "anilist" else None,
+        "idMal": data.get("idMal"),
+        "title": {key: titles.get(key) for key in ("romaji", "english", "native")},
+        "genres": data.get("genres") or [],
+        "startDate": {key: as_int(sd.get(key)) for key in ("year", "month", "day")},
+        "episodes": data.get("episodes"),
+        "status": data.get("status"),
+        "description": data.get("description"),
+        "coverImage": data.get("coverImage") or {},
+        "source": source,
+    }
+
 class AniLister:
     def __init__(self, anime_name: str, year: int) -> None:
         self.__api = "https://graphql.anilist.co"
         self.__ani_name = anime_name
         self.__ani_year = year
         self.__vars = {'search': self.__ani_name, 'seasonYear': self.__ani_year}
+        self.missed = False
 
     def __update_vars(self, year=True) -> None:
         if year:
@@ -129,145 +169,147 @@ class AniLister:
         else:
             self.__vars = {'search': self.__ani_name}
 
+    @staticmethod
+    def build_batch_query(count):
+        args = ", ".join(f"$s{i}: String" for i in range(count))
+        medias = "\n".join(f"    a{i}: Media(search: $s{i}, type: ANIME, format_not_in: [MOVIE, MUSIC, MANGA, NOVEL, ONE_SHOT]) {{{ANIME_BATCH_FIELDS}    }}" for i in range(count))
+        return f"query ({args}) {{\n{medias}\n}}"
+
+    @staticmethod
+    async def search_batch(names, chunk=25):
+        """Look up many titles with aliased Media queries, one request per chunk. Returns {name: data} for the chunks that succeeded."""
+        results = {}
+        for start in range(0, len(names), chunk):
+            part = names[start:start+chunk]
+            query = AniLister.build_batch_query(len(part))
+            variables = {f"s{i}": name for i, name in enumerate(part)}
+            # Unmatched aliases come back as null alongside a 404 "Not Found." error
+            _, resp_json, _ = await http.request('anilist', 'POST', "https://graphql.anilist.co", json={'query': query, 'variables': variables}, timeout=30)
+            if not resp_json or 'data' not in resp_json:
+                continue
+            data = resp_json['data'] or {}
+            for i, name in enumerate(part):
+                results[name] = data.get(f"a{i}") or {}
+        return results
+
+    @staticmethod
+    async def get_by_id(ani_id):
+        res_code, resp_json, _ = await http.request('anilist', 'POST', "https://graphql.anilist.co", json={'query': ANIME_GRAPHQL_QUERY, 'variables': {'id': int(ani_id)}})
+        if res_code == 200 and isinstance(resp_json, dict):
+            return normalize_anidata(resp_json.get('data', {}).get('Media') or {}, "anilist")
+        return {}
+
     async def post_data(self):
-        try:
-            async with ClientSession() as sess:
-                async with sess.post(
-                    self.__api,
-                    json={'query': ANIME_GRAPHQL_QUERY, 'variables': self.__vars},
-                    timeout=15
-                ) as resp:
-                    if resp.status != 200:
-                        return (resp.status, None, resp.headers)
-
-                    if resp.content_type != "application/json":
-                        raise ContentTypeError(
-                            resp.request_info,
-                            resp.history,
-                            message=f"Unexpected content-type: {resp.content_type}"
-                        )
-
-                    return (resp.status, await resp.json(), resp.headers)
-
-        except ContentTypeError as e:
-            await rep.report(f"AniList JSON decode failed: {e}", "error")
-            return (500, None, None)
-        except ClientError as e:
-            await rep.report(f"AniList client error: {e}", "error")
+        res_code, resp_json, res_heads = await http.request('anilist', 'POST', self.__api, json={'query': ANIME_GRAPHQL_QUERY, 'variables': self.__vars})
+        if res_code == 0:
+            await rep.report("AniList client error: Host Unreachable", "error")
             return (503, None, None)
-        except Exception as e:
-            await rep.report(f"Unexpected AniList error: {e}", "error")
-            return (500, None, None)
+        if res_code != 200:
+            return (res_code, None, res_heads)
+        if not isinstance(resp_json, dict):
+            await rep.report("AniList JSON decode failed", "error")
+            return (500, None, res_heads)
+        return (res_code, resp_json, res_heads)
 
     @handle_logs
     async def get_kitsu_data(self):
-        kitsu_api = f"https://kitsu.io/api/edge/anime?filter[text]={self.__ani_name}"
+        kitsu_api = "https://kitsu.io/api/edge/anime"
         try:
-            async with ClientSession() as sess:
-                async with sess.get(kitsu_api, timeout=10) as resp:
-                    if resp.status != 200:
-                        return {}
-
-                    data = await resp.json()
-                    if not data.get("data"):
-                        return {}
-
-                    anime = data["data"][0]["attributes"]
-                    start_year, start_month, start_day = None, None, None
-                    if anime.get("startDate"):
-                        try:
-                            start_year, start_month, start_day = map(int, anime["startDate"].split("-"))
-                        except:
-                            pass
+            status, data, _ = await http.request('kitsu', 'GET', kitsu_api, params={'filter[text]': self.__ani_name}, timeout=10, retries=1)
+            if status != 200 or not data or not data.get("data"):
+                return {}
 
-                    return {
-                        "title": {
-                            "romaji": anime.get("canonicalTitle"),
-                            "english": anime.get("titles", {}).get("en"),
-                            "native": anime.get("titles", {}).get("ja_jp")
-                        },
-                        "genres": anime.get("genres") or [],
-                        "startDate": {
-                            "year": start_year,
-                            "month": start_month,
-                            "day": start_day
-                        },
-                        "episodes": anime.get("episodeCount"),
-                        "status": anime.get("status") or "N/A",
-                        "description": anime.get("synopsis"),
-                        "coverImage": {
-                            "large": anime.get("posterImage", {}).get("original")
-                        }
-                    }
+            anime = data["data"][0]["attributes"]
+            start_year, start_month, start_day = None, None, None
+            if anime.get("startDate"):
+                try:
+                    start_year, start_month, start_day = map(int, anime["startDate"].split("-"))
+                except:
+                    pass
+
+            return {
+                "title": {
+                    "romaji": anime.get("canonicalTitle"),
+                    "english": anime.get("titles", {}).get("en"),
+                    "native": anime.get("titles", {}).get("ja_jp")
+                },
+                "genres": anime.get("genres") or [],
+                "startDate": {
+                    "year": start_year,
+                    "month": start_month,
+                    "day": start_day
+                },
+                "episodes": anime.get("episodeCount"),
+                "status": anime.get("status") or "N/A",
+                "description": anime.get("synopsis"),
+                "coverImage": {
+                    "large": anime.get("posterImage", {}).get("original")
+                }
+            }
         except Exception as e:
             await rep.report(f"Kitsu Fallback Error: {e}", "error")
             return {}
 
     @handle_logs
     async def get_jikan_data(self):
-        jikan_api = f"https://api.jikan.moe/v4/anime?q={self.__ani_name}&limit=1"
+        jikan_api = "https://api.jikan.moe/v4/anime"
         try:
-            async with ClientSession() as sess:
-                async with sess.get(jikan_api, timeout=10) as resp:
-                    if resp.status != 200:
-                        return {}
-                    data = await resp.json()
-                    if not data.get("data"):
-                        return {}
-                    anime = data["data"][0]
-                    return {
-                        "title": {
-                            "romaji": anime.get("title"),
-                            "english": anime.get("title_english"),
-                            "native": anime.get("title_japanese")
-                        },
-                        "genres": [g["name"] for g in anime.get("genres", [])],
-                        "episodes": anime.get("episodes"),
-                        "status": anime.get("status"),
-                        "description": anime.get("synopsis"),
-                        "coverImage": {"large": anime.get("images", {}).get("jpg", {}).get("large_image_url")},
-                        "startDate": {
-                            "year": anime.get("aired", {}).get("from", "").split("-")[0] if anime.get("aired", {}).get("from") else None,
-                            "month": anime.get("aired", {}).get("from", "").split("-")[1] if anime.get("aired", {}).get("from") else None,
-                            "day": anime.get("aired", {}).get("from", "").split("-")[2][:2] if anime.get("aired", {}).get("from") else None
-                        },
-                        "averageScore": anime.get("score", None)
-                    }
+            status, data, _ = await http.request('jikan', 'GET', jikan_api, params={'q': self.__ani_name, 'limit': 1}, timeout=10, retries=1)
+            if status != 200 or not data or not data.get("data"):
+                return {}
+
+            anime = data["data"][0]
+            return {
+                "title": {
+                    "romaji": anime.get("title"),
+                    "english": anime.get("title_english"),
+                    "native": anime.get("title_japanese")
+                },
+                "genres": [g["name"] for g in anime.get("genres", [])],
+                "episodes": anime.get("episodes"),
+                "status": anime.get("status"),
+                "description": anime.get("synopsis"),
+                "coverImage": {"large": anime.get("images", {}).get("jpg", {}).get("large_image_url")},
+                "startDate": {
+                    "year": anime.get("aired", {}).get("from", "").split("-")[0] if anime.get("aired", {}).get("from") else None,
+                    "month": anime.get("aired", {}).get("from", "").split("-")[1] if anime.get("aired", {}).get("from") else None,
+                    "day": anime.get("aired", {}).get("from", "").split("-")[2][:2] if anime.get("aired", {}).get("from") else None
+                },
+                "averageScore": anime.get("score", None)
+            }
         except Exception as e:
             await rep.report(f"Jikan Fallback Error: {e}", "error")
             return {}
 
     @handle_logs
     async def get_ann_data(self):
-        ann_api = f"https://www.animenewsnetwork.com/encyclopedia/reports.xml?id=155&type=anime&name={self.__ani_name}"
+        ann_api = "https://www.animenewsnetwork.com/encyclopedia/reports.xml"
         try:
-            async with ClientSession() as sess:
-                async with sess.get(ann_api, timeout=10) as resp:
-                    if resp.status != 200:
-                        return {}
-                    xml_data = await resp.text()
-                    root = ET.fromstring(xml_data)
-                    anime_data = {}
-                    for item in root.findall(".//item"):
-                        title = item.find("title").text
-                        if self.__ani_name.lower() in title.lower():
-                            release_date = item.find("release_date").text if item.find("release_date") else None
-                            start_date = {}
-                            if release_date:
-                                try:
-                                    start_year, start_month, start_day = map(int, release_date.split("-"))
-                                    start_date = {"year": start_year, "month": start_month, "day": start_day}
-                                except:
-                                    pass
-                            anime_data = {
-                                "title": {"romaji": title},
-                                "description": item.find("description").text or "N/A",
-                                "genres": item.find("genres").text.split(", ") if item.find("genres") else [],
-                                "coverImage": {"large": item.find("image").text} if item.find("image") else {},
-                                "startDate": start_date
-                            }
-                            break
-                    return anime_data
+            status, xml_data, _ = await http.request('ann', 'GET', ann_api, resp_type="text", params={'id': 155, 'type': 'anime', 'name': self.__ani_name}, timeout=10, retries=1)
+            if status != 200 or not xml_data:
+                return {}
+            root = ET.fromstring(xml_data)
+            anime_data = {}
+            for item in root.findall(".//item"):
+                title = item.find("title").text
+                if self.__ani_name.lower() in title.lower():
+                    release_date = item.find("release_date").text if item.find("release_date") else None
+                    start_date = {}
+                    if release_date:
+                        try:
+                            start_year, start_month, start_day = map(int, release_date.split("-"))
+                            start_date = {"year": start_year, "month": start_month, "day": start_day}
+                        except:
+                            pass
+                    anime_data = {
+                        "title": {"romaji": title},
+                        "description": item.find("description").text or "N/A",
+                        "genres": item.find("genres").text.split(", ") if item.find("genres") else [],
+                        "coverImage": {"large": item.find("image").text} if item.find("image") else {},
+                        "startDate": start_date
+                    }
+                    break
+            return anime_data
         except Exception as e:
             await rep.report(f"ANN Fallback Error: {e}", "error")
             return {}
@@ -300,7 +342,7 @@ class AniLister:
 
         return "N/A"
 
-    async def get_anidata(self):
+    async def get_anilist_data(self):
         res_code, resp_json, res_heads = await self.post_data()
         while res_code == 404 and self.__ani_year > 2020:
             self.__update_vars()
@@ -311,28 +353,37 @@ class AniLister:
             self.__update_vars(year=False)
             res_code, resp_json, res_heads = await self.post_data()
 
+        # Only a 404 or a null Media is AniList saying the title does not exist, anything else may pass
+        self.missed = res_code == 404 or (res_code == 200 and not (resp_json.get('data') or {}).get('Media'))
         if res_code == 200:
             return resp_json.get('data', {}).get('Media', {}) or {}
-        elif res_code == 429:
-            f_timer = int(res_heads['Retry-After'])
-            await rep.report(f"AniList API FloodWait: {res_code}, Sleeping for {f_timer} !!", "error")
-            await asleep(f_timer)
-            return await self.get_anidata()
-        elif res_code in [500, 501, 502]:
-            await rep.report(f"AniList Server API Error: {res_code}, Waiting 5s to Try Again !!", "error")
-            await asleep(5)
-            return await self.get_anidata()
-        else:
-            await rep.report(f"AniList API Error: {res_code}, trying Kitsu fallback...", "warning", log=False)
-            kitsu_data = await self.get_kitsu_data()
-            if kitsu_data:
-                return kitsu_data
-            await rep.report(f"Kitsu API failed, trying Jikan fallback...", "warning", log=False)
-            jikan_data = await self.get_jikan_data()
-            if jikan_data:
-                return jikan_data
-            await rep.report(f"Jikan API failed, trying ANN fallback...", "warning", log=False)
-            return await self.get_ann_data()
+        await rep.report(f"AniList API Error: {res_code}", "warning", log=False)
+        return {}
+
+    async def get_anidata(self):
+        """Resolve metadata from AniList. Kitsu, Jikan and ANN are started after HEDGE_DELAY but only answer once AniList came back empty or missed META_DEADLINE, as their results carry no AniList id."""
+        primary = create_task(self.get_anilist_data())
+        done, _ = await wait({primary}, timeout=Var.HEDGE_DELAY)
+        if done and not primary.exception() and (anidata := primary.result()):
+            return normalize_anidata(anidata, "anilist")
+
+        sources = {create_task(coro): source for source, coro in (("kitsu", self.get_kitsu_data()), ("jikan", self.get_jikan_data()), ("ann", self.get_ann_data()))}
+        pending = set(sources)
+        try:
+            if not done:
+                await wait({primary}, timeout=max(Var.META_DEADLINE - Var.HEDGE_DELAY, 0))
+                if primary.done() and not primary.exception() and (anidata := primary.result()):
+                    return normalize_anidata(anidata, "anilist")
+            await rep.report(f"AniList {'Failed' if primary.done() else 'Timed Out'} for {self.__ani_name}, Falling Back to Kitsu, Jikan & ANN...", "warning", log=False)
+            while pending:
+                done, pending = await wait(pending, return_when=FIRST_COMPLETED)
+                for task in done:
+                    if not task.cancelled() and not task.exception() and (anidata := task.result()):
+                        return normalize_anidata(anidata, sources[task])
+            return {}
+        finally:
+            for task in pending | ({primary} if not primary.done() else set()):
+                task.cancel()
 
 class TextEditor:
     def __init__(self, name):
@@ -340,16 +391,39 @@ class TextEditor:
         self.adata = {}
         self.pdata = parse(name)
 
-    async def load_anilist(self):
+    async def name_variants(self):
         cache_names = []
         for option in [(False, False), (False, True), (True, False), (True, True)]:
-            ani_name = await self.parse_name(*option)
-            if ani_name in cache_names:
-                continue
-            cache_names.append(ani_name)
-            self.adata = await AniLister(ani_name, datetime.now().year).get_anidata()
-            if self.adata:
+            if (ani_name := await self.parse_name(*option)) and ani_name not in cache_names:
+                cache_names.append(ani_name)
+        return cache_names
+
+    async def load_anilist(self):
+        # Most specific variant first, alias then search, so "Show S2" never settles for the alias of "Show"
+        for ani_name in await self.name_variants():
+            if (ani_id := await aliases.resolve(ani_name)) and (adata := await self.load_by_id(ani_id)):
+                self.adata = adata
+                return
+            hit, adata = await anicache.get_title(ani_name)
+            if not hit:
+                lister = AniLister(ani_name, datetime.now().year)
+                adata = await lister.get_anidata() or {}
+                if adata or lister.missed:
+                    # Fallback results have no AniList id, keep them only as long as a miss
+                    await anicache.set_title(ani_name, adata, None if adata.get('id') else Var.META_NEG_TTL)
+            if adata:
+                self.adata = adata
                 break
+        if (ani_id := self.adata.get('id')):
+            await aliases.record([ani_name], ani_id)
+
+    @staticmethod
+    async def load_by_id(ani_id):
+        hit, adata = await anicache.get_id(ani_id)
+        if not hit:
+            if (adata := await AniLister.get_by_id(ani_id)):
+                await anicache.set(f"id:{ani_id}", adata)
+        return adata
 
     @handle_logs
     async def get_id(self):
@@ -374,6 +448,14 @@ class TextEditor:
     async def get_poster(self):
         if anime_id := await self.get_id():
             return f"https://img.anili.st/media/{anime_id}"
+        hit, poster = await anicache.get(f"poster:{anicache.normalize(self.__name)}")
+        if hit and poster.get("url"):
+            return poster["url"]
+        poster = await self.__fetch_poster()
+        await anicache.set(f"poster:{anicache.normalize(self.__name)}", {"url": poster})
+        return poster
+
+    async def __fetch_poster(self):
         kitsu_data = await AniLister(self.__name, datetime.now().year).get_kitsu_data()
         if kitsu_data and (poster := kitsu_data.get("coverImage", {}).get("large")):
             return poster
@@ -381,11 +463,9 @@ class TextEditor:
         if jikan_data and (poster := jikan_data.get("coverImage", {}).get("large")):
             return poster
         try:
-            async with ClientSession() as sess:
-                async with sess.get("https://api.waifu.pics/sfw/waifu") as resp:
-                    if resp.status == 200:
-                        data = await resp.json()
-                        return data.get("url", "https://telegra.ph/file/112ec08e59e73b6189a20.jpg")
+            status, data, _ = await http.request('waifu', 'GET', "https://api.waifu.pics/sfw/waifu", retries=1)
+            if status == 200 and data:
+                return data.get("url", "https://telegra.ph/file/112ec08e59e73b6189a20.jpg")
         except Exception as e:
             await rep.report(f"Waifu.pics Fallback Error: {e}", "error")
         return "https://telegra.ph/file/112ec08e59e73b6189a20.jpg"
@@ -7,6 +7,7 @@ from pyrogram.errors import FloodWait
 
 from bot import bot, Var
 from .func_utils import editMessage, convertBytes, convertTime
+from .mediacache import mediacache
 from .reporter import rep
 
 
@@ -23,12 +24,13 @@ class TgUploader:
     async def upload(self, path, qual):
         self.__name = ospath.basename(path)
         self.__qual = qual
+        thumb = await mediacache.get_thumb()
         try:
             if Var.AS_DOC:
                 return await self.__client.send_document(
                     chat_id=Var.FILE_STORE,
                     document=path,
-                    thumb="thumb.jpg" if ospath.exists("thumb.jpg") else None,
+                    thumb=thumb,
                     caption=f"<i>{self.__name}</i>",
                     force_document=True,
                     progress=self.progress_status
@@ -37,7 +39,7 @@ class TgUploader:
                 return await self.__client.send_video(
                     chat_id=Var.FILE_STORE,
                     video=path,
-                    thumb="thumb.jpg" if ospath.exists("thumb.jpg") else None,
+                    thumb=thumb,
                     caption=f"<i>{self.__name}</i>",
                     progress=self.progress_status
                 )
@@ -1,28 +1,265 @@
-from os import path as ospath
+from time import time
+from os import path as ospath, makedirs
+from dataclasses import dataclass
+from urllib.parse import quote
+from asyncio import sleep as asleep, Semaphore
 from aiofiles import open as aiopen
 from aiofiles.os import path as aiopath, remove as aioremove, mkdir
 
+import libtorrent as lt
 from aiohttp import ClientSession
-from torrentp import TorrentDownloader
-from bot import LOGS
+from bot import LOGS, Var
 from bot.core.func_utils import handle_logs
+from bot.core.reporter import rep
+
+
+tormetrics = {}
+
+@dataclass
+class TorProgress:
+    name: str = ""
+    done: int = 0
+    total: int = 0
+    rate: int = 0
+    peers: int = 0
+    seeds: int = 0
+    eta: float = 0.0
+    stalled_for: float = 0.0
+    finished: bool = False
+
+    @classmethod
+    def from_status(cls, status, stalled_for=0.0):
+        return cls(
+            name=status.name,
+            done=status.total_wanted_done,
+            total=status.total_wanted,
+            rate=status.download_rate,
+            peers=status.num_peers,
+            seeds=status.num_seeds,
+            eta=(status.total_wanted - status.total_wanted_done) / status.download_rate if status.download_rate else 0.0,
+            stalled_for=stalled_for,
+            finished=status.is_seeding or status.is_finished,
+        )
+
+
+class StallWatch:
+    """Tracks how long a torrent has stayed under STALL_KBPS, metadata fetching included."""
+    def __init__(self):
+        self.__since = time()
+
+    def update(self, status):
+        if status.download_rate >= Var.STALL_KBPS * 1024 or status.is_seeding or status.is_finished:
+            self.__since = time()
+        return time() - self.__since
+
+    def stalled(self, status):
+        return Var.STALL_WINDOW > 0 and self.update(status) >= Var.STALL_WINDOW
+
+
+class TorSession:
+    """The bot's one libtorrent session, kept for its lifetime with DHT state saved across restarts and at most TOR_SLOTS torrents downloading at once."""
+    def __init__(self, state_file="torrents/session.state", slots=2):
+        self.__state_file = state_file
+        self.__session = None
+        self.__slots = slots
+        self.slots = Semaphore(slots)
+
+    @property
+    def session(self):
+        if self.__session is None:
+            params = lt.session_params()
+            if ospath.exists(self.__state_file):
+                try:
+                    with open(self.__state_file, "rb") as f:
+                        params = lt.read_session_params(f.read(), lt.save_state_flags_t.dht_state)
+                except Exception as e:
+                    LOGS.warning(f"Torrent Session State Unreadable, Starting Fresh : {e}")
+            self.__session = lt.session(params)
+            self.__session.apply_settings({
+                'listen_interfaces': Var.TOR_LISTEN,
+                'enable_dht': True,
+                'enable_lsd': True,
+                'enable_upnp': True,
+                'enable_natpmp': True,
+                'alert_mask': 0,
+                'download_rate_limit': Var.TOR_DL_KBPS * 1024,
+                'upload_rate_limit': Var.TOR_UL_KBPS * 1024,
+                # Match libtorrent's own queue to our slots so an admitted torrent is never left paused at 0 B/s
+                'active_downloads': self.__slots,
+                'active_limit': self.__slots,
+            })
+        return self.__session
+
+    def save(self):
+        if self.__session is None:
+            return
+        try:
+            buf = lt.write_session_params_buf(self.__session.session_state(lt.save_state_flags_t.dht_state))
+            makedirs(ospath.dirname(self.__state_file), exist_ok=True)
+            with open(self.__state_file, "wb") as f:
+                f.write(buf)
+        except Exception as e:
+            LOGS.error(f"Saving Torrent Session State Failed : {e}")
+
+    def add(self, params, save_path, priority=False):
+        params.save_path = save_path
+        handle = self.session.add_torrent(params)
+        handle.set_download_limit(Var.TOR_TORRENT_DL_KBPS * 1024)
+        handle.set_upload_limit(Var.TOR_TORRENT_UL_KBPS * 1024)
+        if priority:
+            handle.queue_position_top()
+        return handle
+
+    def remove(self, handle):
+        try:
+            self.session.remove_torrent(handle)
+        except Exception as e:
+            LOGS.warning(f"Removing Torrent Failed : {e}")
+        self.save()
+
+tor_session = TorSession(slots=Var.TOR_SLOTS)
+
+
+class TorStream:
+    """A torrent fetched piece by piece in order, whose largest file can be read from the start while the rest is still downloading."""
+    def __init__(self, handle, save_path):
+        self.__handle = handle
+        self.__save_path = save_path
+        self.__info = None
+        self.__offset = 0
+        self.__closed = False
+        self.__watch = StallWatch()
+        self.path = None
+        self.size = 0
+
+    async def start(self, head=8 * 1024 ** 2):
+        while not (status := self.__handle.status()).has_metadata:
+            if self.__watch.stalled(status):
+                raise TimeoutError("Torrent Metadata Stalled")
+            await asleep(1)
+        self.__info = self.__handle.torrent_file()
+        files = self.__info.files()
+        index = max(range(files.num_files()), key=files.file_size)
+        self.__handle.prioritize_files([4 if i == index else 0 for i in range(files.num_files())])
+        self.__handle.set_sequential_download(True)
+        self.__offset, self.size = files.file_offset(index), files.file_size(index)
+        self.path = ospath.join(self.__save_path, files.file_path(index))
+        await self.wait_range(0, min(head, self.size))
+        return self
+
+    def __pieces(self, pos, length):
+        piece_len = self.__info.piece_length()
+        return range((self.__offset + pos) // piece_len, (self.__offset + pos + max(length, 1) - 1) // piece_len + 1)
+
+    async def wait_range(self, pos, length, lookahead=16):
+        """Block until the bytes [pos, pos + length) of the file are on disk, asking for the next pieces with deadlines."""
+        pieces = self.__pieces(pos, length)
+        for i, piece in enumerate(range(pieces.start, min(pieces.start + lookahead, self.__info.num_pieces()))):
+            self.__handle.set_piece_deadline(piece, 1000 + 200 * i)
+        while not all(self.__handle.have_piece(piece) for piece in pieces):
+            if self.__watch.stalled(status := self.__handle.status()):
+                raise TimeoutError(f"Torrent Stalled Under {Var.STALL_KBPS} KB/s for {Var.STALL_WINDOW}s")
+            tormetrics[status.name] = TorProgress.from_status(status)
+            await asleep(0.5)
+
+    async def chunks(self, size=1024 ** 2):
+        pos = 0
+        async with aiopen(self.path, "rb") as f:
+            while pos < self.size:
+                length = min(size, self.size - pos)
+                await self.wait_range(pos, length)
+                await f.seek(pos)
+                chunk = await f.read(length)
+                pos += len(chunk)
+                yield chunk
+
+    @property
+    def finished(self):
+        return self.__handle.status().is_seeding or self.__handle.status().is_finished
+
+    async def wait(self):
+        while not self.finished:
+            await asleep(2)
+        return self.path
+
+    def close(self):
+        if not self.__closed:
+            self.__closed = True
+            tormetrics.pop(self.__handle.status().name, None)
+            tor_session.remove(self.__handle)
+            tor_session.slots.release()
+
 
 class TorDownloader:
     def __init__(self, path="."):
         self.__downdir = path
         self.__torpath = "torrents/"
+        self.stalled = False
 
-    @handle_logs
-    async def download(self, torrent, name=None):
+    async def get_params(self, torrent):
         if torrent.startswith("magnet:"):
-            torp = TorrentDownloader(torrent, self.__downdir)
-            await torp.start_download()
-            return ospath.join(self.__downdir, name)
-        elif torfile := await self.get_torfile(torrent):
-            torp = TorrentDownloader(torfile, self.__downdir)
-            await torp.start_download()
+            return lt.parse_magnet_uri(torrent)
+        if torfile := await self.get_torfile(torrent):
+            params = lt.add_torrent_params()
+            params.ti = lt.torrent_info(torfile)
             await aioremove(torfile)
-            return ospath.join(self.__downdir, torp._torrent_info._info.name())
+            return params
+        return None
+
+    @staticmethod
+    def alt_source(info_hash, name):
+        """A magnet for the same infohash announcing to TOR_TRACKERS, for when the original swarm is dead."""
+        return f"magnet:?xt=urn:btih:{info_hash}&dn={quote(name or info_hash)}" + "".join(f"&tr={quote(tr)}" for tr in Var.TOR_TRACKERS)
+
+    async def __fetch(self, params, name, progress, priority):
+        """Run one torrent to completion, returning (path, info_hash) with path None when it stalled."""
+        watch = StallWatch()
+        handle = tor_session.add(params, self.__downdir, priority)
+        info_hash = str(handle.info_hash())
+        try:
+            while not (status := handle.status()).is_seeding and not status.is_finished:
+                stalled_for = watch.update(status)
+                tormetrics[name] = prog = TorProgress.from_status(status, stalled_for)
+                if progress:
+                    await progress(prog)
+                if Var.STALL_WINDOW > 0 and stalled_for >= Var.STALL_WINDOW:
+                    LOGS.warning(f"Torrent Stalled for {int(stalled_for)}s : {name}")
+                    return None, info_hash
+                await asleep(3)
+            if progress:
+                await progress(TorProgress.from_status(status))
+            return ospath.join(self.__downdir, handle.torrent_file().name()) if status.has_metadata else ospath.join(self.__downdir, name), info_hash
+        finally:
+            tormetrics.pop(name, None)
+            tor_session.remove(handle)
+
+    @handle_logs
+    async def download(self, torrent, name=None, progress=None, priority=False):
+        """Download through the shared session, calling progress(TorProgress) every few seconds. Returns the downloaded file or dir, or None with self.stalled set when every source stalled."""
+        self.stalled = False
+        if not (params := await self.get_params(torrent)):
+            return None
+        async with tor_session.slots:
+            path, info_hash = await self.__fetch(params, name, progress, priority)
+            if path is None and Var.TOR_TRACKERS:
+                await rep.report(f"Torrent Stalled, Retrying with Alternate Trackers...\n\n{name}", "warning")
+                path, _ = await self.__fetch(lt.parse_magnet_uri(self.alt_source(info_hash, name)), name, progress, priority)
+            self.stalled = path is None
+            return path
+
+    @handle_logs
+    async def stream(self, torrent, name=None, priority=False):
+        """Start a sequential download and return a TorStream once the head of its file is readable."""
+        if not (params := await self.get_params(torrent)):
+            return None
+        await tor_session.slots.acquire()
+        stream = TorStream(tor_session.add(params, self.__downdir, priority), self.__downdir)
+        try:
+            return await stream.start(Var.STREAM_HEAD_MB * 1024 ** 2)
+        except BaseException as e:
+            self.stalled = isinstance(e, TimeoutError)
+            stream.close()
+            raise
 
     @handle_logs
     async def get_torfile(self, url):
@@ -1,22 +1,11 @@
-import asyncio
-import json
 import os
-import subprocess
 
-from pathlib import Path
+from bot.core.probe import prober
+from bot.core.addons import make_addons
 
 
 async def genss(file):
-    process = subprocess.Popen(
-        ["mediainfo", file, "--Output=JSON"],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-    )
-    stdout, _ = process.communicate()
-    out = stdout.decode().strip()
-    data = json.loads(out)
-    duration = data["media"]["track"][0]["Duration"]
-    return int(duration.split(".")[-2])
+    return int(await prober.duration(file))
 
 
 def convertTime(seconds):
@@ -41,43 +30,16 @@ async def gen_ss_sam(hash_dir, filename, log):
             log.error("❌ Input file does not exist.")
             return "", ""
 
-        os.makedirs(hash_dir, exist_ok=True)
-
-        tsec = await genss(filename)
-        fps = 10 / tsec
-
-        # Generate 10 screenshots
-        screenshot_cmd = f"ffmpeg -i '{filename}' -vf fps={fps} -vframes 10 '{hash_dir}/pic%01d.png'"
-        process = await asyncio.create_subprocess_shell(
-            screenshot_cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        await process.communicate()
-
-        ss, dd = await duration_s(filename)
-        out_sample = os.path.splitext(filename)[0] + "_sample.mkv"
-
-        # Create sample video
-        sample_cmd = (
-            f'ffmpeg -i "{filename}" -preset ultrafast -ss {ss} -to {dd} '
-            f'-c:v copy -crf 27 -map 0:v -c:a aac -map 0:a -c:s copy -map 0:s? "{out_sample}" -y'
-        )
-        process = await asyncio.create_subprocess_shell(
-            sample_cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        _, stderr = await process.communicate()
-        error_log = stderr.decode().strip()
-
-        if not os.path.exists(out_sample) or os.path.getsize(out_sample) == 0:
+        # Keyframe seeked screenshots and a stream copied sample, see bot.core.addons
+        shots, _, out_sample = await make_addons(filename, hash_dir)
+        if not shots:
+            log.error("⚠️ Screenshots not generated.")
+        if not out_sample:
             log.error("⚠️ Sample file not generated or is empty.")
-            log.error(error_log)
             return "", ""
 
         return hash_dir, out_sample
 
     except Exception as err:
         log.error(f"🔥 gen_ss_sam failed: {err}")
-        return "", ""
\ No newline at end of file
+        return "", ""
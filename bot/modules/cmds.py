@@ -1,3 +1,4 @@
+from time import time
 from asyncio import sleep as asleep, gather
 from pyrogram.filters import command, private, user
 from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup
@@ -5,8 +6,16 @@ from pyrogram.errors import FloodWait, MessageNotModified
 
 from bot import bot, bot_loop, Var, ani_cache
 from bot.core.database import db
-from bot.core.func_utils import decode, is_fsubbed, get_fsubs, editMessage, sendMessage, new_task, convertTime, getfeed
+from bot.core.func_utils import decode, is_fsubbed, get_fsubs, editMessage, sendMessage, new_task, convertTime, convertBytes, getfeed
 from bot.core.auto_animes import get_animes
+from bot.core.anicache import anicache, aliases
+from bot.core.text_utils import TextEditor
+from bot.core.http_client import http
+from bot.core.ffencoder import ffmetrics
+from bot.core.tordownload import tormetrics
+from bot.core.benchmark import EncodeBenchmark
+from bot.core.ffqueue import ffsched
+from bot.core.storage import storage
 from bot.core.reporter import rep
 
 @bot.on_message(command('start') & private)
@@ -90,6 +99,96 @@ async def pause_fetch(client, message):
 async def _log(client, message):
     await message.reply_document("log.txt", quote=True)
 
+@bot.on_message(command('stats') & private & user(Var.ADMINS))
+@new_task
+async def _stats(client, message):
+    txt = http.stats()
+    free, total, pending, jobs = storage.stats()
+    txt += f"\n<b>Disk :</b> {convertBytes(free)} free of {convertBytes(total)}, {convertBytes(pending) or '0 B'} reserved by {jobs} jobs\n"
+    if tormetrics:
+        txt += "\n<b>Running Downloads</b>\n\n"
+        txt += "\n".join(f"• <i>{name}</i> : {prog.done * 100 / prog.total if prog.total else 0:.1f}%, {convertBytes(prog.rate) or '0 B'}/s, {prog.peers} peers" + (f", stalled {convertTime(prog.stalled_for)}" if prog.stalled_for >= 60 else "") for name, prog in tormetrics.items())
+        txt += "\n"
+    if ffmetrics:
+        txt += "\n<b>Running Encodes</b>\n\n"
+        txt += "\n".join(f"• <i>{name}</i> : {prog.fps:.1f} fps, {prog.speed:.2f}x, {convertTime(prog.out_time) or '0s'} done" for name, prog in ffmetrics.items())
+    await sendMessage(message, txt)
+
+@bot.on_message(command('benchmark') & private & user(Var.ADMINS))
+@new_task
+async def _benchmark(client, message):
+    args = message.text.split()
+    seconds = int(args[1]) if len(args) > 1 and args[1].isdigit() else 20
+    bench = EncodeBenchmark(seconds, presets=args[2:] or None)
+    stat_msg = await sendMessage(message, "<i>Waiting for a Free Encode Slot...</i>")
+    async def progress(step):
+        await editMessage(stat_msg, f"<b>Benchmarking...</b>\n\n<i>{step}</i>")
+    try:
+        async with ffsched.slot("benchmark", "Encoder Benchmark", priority=float("-inf")):
+            await bench.run(progress)
+    except Exception as e:
+        return await editMessage(stat_msg, f"<b>Benchmark Failed :</b> <code>{e}</code>")
+    await editMessage(stat_msg, bench.report())
+
+@bot.on_message(command('queue') & private & user(Var.ADMINS))
+@new_task
+async def _queue(client, message):
+    if not (jobs := ffsched.jobs()):
+        return await sendMessage(message, "<b>Encode Queue is Empty</b>")
+    txt = "<b>Encode Queue</b>\n\n"
+    for state, entry in jobs:
+        since = convertTime(time() - entry.get('started', entry['queued'])) or '0s'
+        txt += f"• <code>{entry['key']}</code> [{state}, {since}] <b>P {entry['priority']}</b>\n    <i>{entry['name']}</i>\n"
+    await sendMessage(message, txt + "\n<i>Use /prio Key Priority to Re-Prioritize a Queued Job</i>")
+
+@bot.on_message(command('prio') & private & user(Var.ADMINS))
+@new_task
+async def _prio(client, message):
+    args = message.text.split()
+    try:
+        key, priority = int(args[1]), float(args[2])
+    except (IndexError, ValueError):
+        return await sendMessage(message, "<b>Usage :</b> <code>/prio Key Priority</code>")
+    if not ffsched.set_priority(key, priority):
+        return await sendMessage(message, f"<b>No Queued Job Found with Key {key}</b>")
+    await sendMessage(message, f"<i><b>Job {key} Re-Prioritized to {priority}</b></i>")
+
+async def alias_names(name):
+    return list(dict.fromkeys([name] + await TextEditor(name).name_variants()))
+
+@bot.on_message(command('alias') & private & user(Var.ADMINS))
+@new_task
+async def _alias(client, message):
+    if len(args := message.text.split(maxsplit=1)) <= 1:
+        return await sendMessage(message, "<b>Usage :</b> <code>/alias Release or Anime Name</code>")
+    txt = "<b>Alias Index Lookup</b>\n\n"
+    for name in await alias_names(args[1]):
+        if (alias := await aliases.get(name)):
+            titles = (await TextEditor.load_by_id(alias['ani_id'])).get('title', {})
+            txt += f"• <code>{anicache.normalize(name)}</code> → <code>{alias['ani_id']}</code> <i>{titles.get('english') or titles.get('romaji') or ''}</i>{' (manual)' if alias.get('manual') else ''}\n"
+        else:
+            txt += f"• <code>{anicache.normalize(name)}</code> → <i>Not Indexed</i>\n"
+    await sendMessage(message, txt)
+
+@bot.on_message(command('setalias') & private & user(Var.ADMINS))
+@new_task
+async def _setalias(client, message):
+    if len(args := message.text.split(maxsplit=2)) <= 2 or not args[1].isdigit():
+        return await sendMessage(message, "<b>Usage :</b> <code>/setalias AniList_ID Release or Anime Name</code>")
+    if not (adata := await TextEditor.load_by_id(int(args[1]))):
+        return await sendMessage(message, f"<b>AniList ID {args[1]} Not Found !</b>")
+    names = [await aliases.set(name, int(args[1])) for name in await alias_names(args[2])]
+    titles = adata.get('title', {})
+    await sendMessage(message, f"<i><b>Alias Updated Successfully!</b></i>\n\n    • <b>Anime :</b> {titles.get('english') or titles.get('romaji')}\n    • <b>Aliases :</b> <code>{', '.join(names)}</code>")
+
+@bot.on_message(command('delalias') & private & user(Var.ADMINS))
+@new_task
+async def _delalias(client, message):
+    if len(args := message.text.split(maxsplit=1)) <= 1:
+        return await sendMessage(message, "<b>Usage :</b> <code>/delalias Release or Anime Name</code>")
+    names = [alias for name in await alias_names(args[1]) if (alias := await aliases.remove(name))]
+    await sendMessage(message, f"<b>Removed Aliases :</b> <code>{', '.join(names)}</code>" if names else "<b>No Alias Found to Remove</b>")
+
 @bot.on_message(command('addlink') & private & user(Var.ADMINS))
 @new_task
 async def add_task(client, message):
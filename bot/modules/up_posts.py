@@ -1,10 +1,11 @@
 from os import execl, path as ospath
 from sys import executable
-from json import loads as jloads
-from aiohttp import ClientSession
 
-from bot import Var, bot, ffQueue
-from bot.core.text_utils import TextEditor
+from bot import Var, bot
+from bot.core.ffqueue import ffsched
+from bot.core.anicache import anicache
+from bot.core.feedreader import get_schedule
+from bot.core.text_utils import AniLister
 from bot.core.reporter import rep
 
 # Global to hold the schedule message for update
@@ -14,15 +15,22 @@ async def upcoming_animes():
     global TD_SCHR
     if Var.SEND_SCHEDULE:
         try:
-            async with ClientSession() as ses:
-                res = await ses.get("https://subsplease.org/api/?f=schedule&h=true&tz=Asia/Kolkata")
-                aniContent = jloads(await res.text())["schedule"]
+            if (aniContent := await get_schedule()) is None:
+                raise ValueError("Failed to Fetch SubsPlease Schedule")
+
+            anidata = {}
+            for i in aniContent:
+                hit, data = await anicache.get(f"brief:{anicache.normalize(i['title'])}")
+                if hit:
+                    anidata[i["title"]] = data
+            if (misses := list(dict.fromkeys(i["title"] for i in aniContent if i["title"] not in anidata))):
+                for name, data in (await AniLister.search_batch(misses)).items():
+                    anidata[name] = data
+                    await anicache.set(f"brief:{anicache.normalize(name)}", data)
 
             text = "<b>📆 Today's Anime Releases Schedule [IST]</b>\n\n"
             for i in aniContent:
-                aname = TextEditor(i["title"])
-                await aname.load_anilist()
-                title = aname.adata.get('title', {}).get('english') or i['title']
+                title = (anidata.get(i["title"]) or {}).get('title', {}).get('english') or i['title']
                 text += f'''🕒 <a href="https://subsplease.org/shows/{i['page']}">{title}</a>\n    • <b>Time</b> : {i["time"]} hrs\n\n'''
 
             TD_SCHR = await bot.send_message(Var.MAIN_CHANNEL, text)
@@ -30,8 +38,8 @@ async def upcoming_animes():
         except Exception as err:
             await rep.report(str(err), "error")
 
-    if not ffQueue.empty():
-        await ffQueue.join()
+    if not ffsched.empty():
+        await ffsched.join()
 
     await rep.report("Auto Restarting..!!", "info")
     execl(executable, executable, "-m", "bot")
@@ -0,0 +1,81 @@
+from time import time
+from socket import gethostname
+from os import getpid, path as ospath
+from asyncio import sleep as asleep, create_task
+from aiofiles import open as aiopen
+from aiofiles.os import makedirs as aiomakedirs, remove as aioremove
+from aioshutil import move as aiomove
+from aiohttp import ClientTimeout
+
+from bot import Var, bot_loop, LOGS
+from bot.core.ffencoder import FFEncoder
+from bot.core.http_client import http
+from bot.core.jobqueue import jobqueue
+
+worker_id = f"{gethostname()}:{getpid()}"
+
+async def heartbeat(job_id, encoder):
+    """Renew the lease every third of JOB_LEASE and cancel the encode once another worker has taken the job over."""
+    while True:
+        await asleep(Var.JOB_LEASE / 3)
+        if not await jobqueue.store.update(job_id, {'lease_until': time() + Var.JOB_LEASE, 'progress': encoder.percent(encoder.last_progress)}, worker_id):
+            LOGS.warning(f"Lost Lease on Job {job_id}, Cancelling Encode")
+            await encoder.cancel_encode()
+            return
+
+async def fetch_source(job):
+    if not job['src'].startswith(("http://", "https://")):
+        return job['src']
+    path = ospath.join("downloads", f"job_{job['_id']}.mkv")
+    await aiomakedirs("downloads", exist_ok=True)
+    # Streamed to disk in chunks, a source can be well over a gigabyte
+    async with (await http.session()).get(job['src'], timeout=ClientTimeout(total=None, sock_read=300)) as resp:
+        if resp.status != 200:
+            raise ValueError(f"Source Download Failed for {job['src']} [{resp.status}]")
+        async with aiopen(path, "wb") as f:
+            async for chunk in resp.content.iter_chunked(1024 ** 2):
+                await f.write(chunk)
+    return path
+
+async def run_job(job):
+    LOGS.info(f"Claimed Encode Job {job['_id']} ({job['qual']}p) : {job['name']}")
+    encoder, beat = None, None
+    try:
+        src = await fetch_source(job)
+        encoder = FFEncoder(None, src, job['name'], job['qual'], job['_id'], ffcode=job.get('ffcode'))
+        beat = create_task(heartbeat(job['_id'], encoder))
+        if not (out_path := await encoder.start_encode()):
+            raise ValueError("Encode Failed" if not encoder.is_cancelled else "Encode Cancelled")
+        await aiomakedirs(Var.JOB_OUT_DIR, exist_ok=True)
+        final_path = ospath.abspath(ospath.join(Var.JOB_OUT_DIR, ospath.basename(out_path)))
+        if ospath.abspath(out_path) != final_path:
+            await aiomove(out_path, final_path)
+        await jobqueue.store.update(job['_id'], {'status': 'done', 'progress': 100, 'result': {'out_path': final_path}}, worker_id)
+        LOGS.info(f"Finished Encode Job {job['_id']} : {final_path}")
+    except Exception as e:
+        LOGS.error(f"Encode Job {job['_id']} Failed : {e}")
+        status = 'queued' if job['attempts'] < Var.JOB_RETRIES else 'failed'
+        await jobqueue.store.update(job['_id'], {'status': status, 'worker': None, 'lease_until': 0, 'error': str(e)}, worker_id)
+    finally:
+        if beat:
+            beat.cancel()
+        if ospath.exists(fetched := ospath.join("downloads", f"job_{job['_id']}.mkv")):
+            await aioremove(fetched)
+        await FFEncoder.clean_job(job['_id'])
+
+async def main():
+    if jobqueue is None:
+        LOGS.error("JOB_QUEUE is not Set, Nothing to Work on !!")
+        return
+    LOGS.info(f"Encode Worker {worker_id} Started !!")
+    while True:
+        if not (job := await jobqueue.store.claim(worker_id, Var.JOB_LEASE)):
+            await asleep(5)
+            continue
+        await run_job(job)
+
+if __name__ == "__main__":
+    try:
+        bot_loop.run_until_complete(main())
+    finally:
+        bot_loop.run_until_complete(http.close())